@@ -1,42 +1,62 @@
 import pygame
+import numpy as np
 from typing import Union
-import time
 
-class Animation():
-    def __init__(self, images: list, image_duration: Union[float, int] = 100, loop: bool = True) -> None:
+class Animation_Clip:
+    __slots__ = ("images", "flipped_images", "image_duration", "loop", "number_of_images")
+
+    def __init__(self, images: list, image_duration: Union[float, int] = 100, loop: bool = True, flipped_images: list | None = None) -> None:
+        # the frames of an animation, shared by everything that plays it. nothing about playing it is stored here, whoever plays
+        # a clip keeps the time it started and asks for the frame at the time elapsed since then
         self.images = images
+        # every frame flipped in all four combinations, indexed by flip_x | (flip_y << 1). flipping both ways is the same as rotating 180 degrees
+        if flipped_images is None:
+            flipped_images = [images] + [[pygame.transform.flip(image, flip_x, flip_y) for image in images] for flip_x, flip_y in ((True, False), (False, True), (True, True))]
+        self.flipped_images = flipped_images
         self.image_duration = image_duration
         self.loop = loop
-        self.done = False
-
-        self.image = 0
         self.number_of_images = len(images)
 
-        self.start_time_s = time.time()
-        self.current_time_s = self.start_time_s
-        self.time_elapsed_ms = 0
-    
-    def _calculate_image(self) -> int:
+    def get_image_index(self, time_elapsed_ms: float) -> int:
+        # a clip that does not loop stays on its last frame once it is done
+        image = int(time_elapsed_ms // self.image_duration)
         if self.loop:
-            return int(self.time_elapsed_ms // self.image_duration) % self.number_of_images
-        else:
-            return min(int(self.time_elapsed_ms // self.image_duration), self.number_of_images)  
-    
-    def copy(self) -> "Animation":
-        return Animation(images = self.images, image_duration = self.image_duration, loop = self.loop)
-    
-    def get_image(self) -> pygame.Surface:
-        return self.images[self.image]
-
-    def update(self) -> None:
-        self.current_time_s = time.time()
-        self.time_elapsed_ms = int((self.current_time_s - self.start_time_s)*1000)
-
-        self.image = self._calculate_image()
-        
-        if self.image > self.number_of_images - 1:
-            self.image = self.number_of_images - 1
-            self.done = True
-
-    
+            return image % self.number_of_images
+        return min(image, self.number_of_images - 1)
+
+    def get_image_indices(self, time_elapsed_ms: np.ndarray) -> np.ndarray:
+        # get_image_index for every instance playing this clip at once
+        images = (np.asarray(time_elapsed_ms) // self.image_duration).astype(np.int32)
+        if self.loop:
+            return images % self.number_of_images
+        return np.minimum(images, self.number_of_images - 1)
+
+    def get_image(self, time_elapsed_ms: float, flip_x: bool = False, flip_y: bool = False) -> pygame.Surface:
+        return self.flipped_images[flip_x | (flip_y << 1)][self.get_image_index(time_elapsed_ms)]
+
+class Animation_Library:
+    def __init__(self, clips: dict | None = None) -> None:
+        # hands out a small id per clip, so an instance playing a clip only has to store the id and its start time
+        self.clips = []
+        self.names = []
+        self.clip_ids = {}
+        for name, clip in (clips or {}).items():
+            self.add(name, clip)
+
+    def __len__(self) -> int:
+        return len(self.clips)
+
+    def add(self, name: str, clip: Animation_Clip) -> int:
+        clip_id = self.clip_ids.get(name)
+        if clip_id is not None:
+            self.clips[clip_id] = clip
+            return clip_id
+
+        clip_id = len(self.clips)
+        self.clips.append(clip)
+        self.names.append(name)
+        self.clip_ids[name] = clip_id
+        return clip_id
 
+    def get_id(self, name: str) -> int:
+        return self.clip_ids[name]
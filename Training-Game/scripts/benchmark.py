@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+# the benchmark always runs without a window, this has to be set before pygame initialises its video system
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+# asset paths in Settings are relative to the scripts folder, paths given on the command line are relative to where it was started
+LAUNCH_DIRECTORY = os.getcwd()
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+import numpy as np
+
+from settings import Settings
+from game import Game
+from entity import Player
+
+def place_entities(game: Game, count: int, rng: random.Random) -> list:
+    # spread over the inside of the test level room, x 1..19 and y -4..4 in tiles
+    tile_size = game.tilemap.tile_size
+    size = game.settings.entities["player"]["size"]
+    entities = []
+    for _ in range(count):
+        position = (rng.uniform(tile_size + 1, 20 * tile_size - size[0] - 1), rng.uniform(-4 * tile_size, 5 * tile_size - size[1] - 1))
+        entities.append(Player(game, position, size, speed=game.settings.entities["player"]["speed"]))
+    return entities
+
+def scene_huge_tilemap(game: Game, rng: random.Random) -> dict:
+    # 3 tile thick floors every 12 rows with open corridors in between, the existing floor and ceiling at y = 5 and y = -5 line up with it
+    tilemap = game.tilemap
+    tilemap.clear()
+    for y in range(-600, 600):
+        if (y - 5) % 12 < 3:
+            for x in range(-10, 4000):
+                tilemap.set_tile((x, y), "grass")
+    tilemap.compile()
+
+    def script(frame: int) -> None:
+        game.player_movement = [False, True]
+        if frame % 90 == 0:
+            game.player.switch_ground()
+
+    return {"entities": [], "movements": [], "script": script}
+
+def scene_particle_storm(game: Game, rng: random.Random) -> dict:
+    entities = place_entities(game, 200, rng)
+
+    def script(frame: int) -> None:
+        for i, entity in enumerate(entities):
+            if (frame + i) % 8 == 0:
+                entity.switch_ground()
+
+    return {"entities": entities, "movements": [(0, 0)] * len(entities), "script": script}
+
+def scene_many_entities(game: Game, rng: random.Random) -> dict:
+    entities = place_entities(game, 1000, rng)
+    movements = [(0, 0)] * len(entities)
+
+    def script(frame: int) -> None:
+        for i, entity in enumerate(entities):
+            if (frame + i) % 60 == 0:
+                movements[i] = (rng.choice((-1, 0, 1)), 0)
+            if (frame + i) % 240 == 0:
+                entity.switch_ground()
+
+    return {"entities": entities, "movements": movements, "script": script}
+
+def scene_spread_entities(game: Game, rng: random.Random) -> dict:
+    # 2000 entities walking along floors spread over a 4000 x 1200 tile level, only a few of them are ever near the camera
+    tilemap = game.tilemap
+    tilemap.clear()
+    for y in range(-600, 600):
+        if (y - 5) % 12 < 3:
+            for x in range(-10, 4000):
+                tilemap.set_tile((x, y), "grass")
+    tilemap.compile()
+    game.settings.simulation_active_radius = 1500
+
+    tile_size = tilemap.tile_size
+    size = game.settings.entities["player"]["size"]
+    entities = []
+    for _ in range(2000):
+        # standing on top of a floor, floors start at every y = 5 + 12 * n
+        position = (rng.uniform(0, 3990 * tile_size), (5 + 12 * rng.randrange(-50, 49)) * tile_size - size[1] - 1)
+        entities.append(Player(game, position, size, speed=game.settings.entities["player"]["speed"]))
+    movements = [(rng.choice((-1, 1)), 0) for _ in entities]
+
+    def script(frame: int) -> None:
+        game.player_movement = [False, True]
+        for i in range(frame % 60, len(entities), 60):
+            movements[i] = (-movements[i][0], 0)
+
+    return {"entities": entities, "movements": movements, "script": script}
+
+def scene_fullscreen_scaling(game: Game, rng: random.Random) -> dict:
+    def script(frame: int) -> None:
+        game.player_movement = [frame % 120 >= 60, frame % 120 < 60]
+        if frame % 45 == 0:
+            game.player.switch_ground()
+
+    return {"entities": [], "movements": [], "script": script}
+
+SCENES = {
+    "huge_tilemap": {"setup": scene_huge_tilemap, "screen_size": None},
+    "particle_storm": {"setup": scene_particle_storm, "screen_size": None},
+    "many_entities": {"setup": scene_many_entities, "screen_size": None},
+    "spread_entities": {"setup": scene_spread_entities, "screen_size": None},
+    "fullscreen_scaling": {"setup": scene_fullscreen_scaling, "screen_size": (3840, 2160)},
+}
+
+def create_game(scene: dict, seed: int) -> tuple:
+    random.seed(seed)
+    settings = Settings()
+    if scene["screen_size"]:
+        settings.screen_size = scene["screen_size"]
+        settings.display_size = (settings.screen_size[0] * settings.display_scaling_factor, settings.screen_size[1] * settings.display_scaling_factor)
+    pygame.display.set_mode(settings.screen_size)
+
+    game = Game(settings)
+    game.profiler.set_enabled(True)
+    scene_data = scene["setup"](game, random.Random(seed))
+    return game, scene_data
+
+def run_frame(game: Game, scene_data: dict, frame: int, timings: dict | None) -> None:
+    scene_data["script"](frame)
+    dt = game.fixed_dt
+
+    game.profiler.begin_frame()
+    start = time.perf_counter()
+    game.step()
+    simulation_end = time.perf_counter()
+    game.update_entities(scene_data["entities"], scene_data["movements"], dt)
+    entities_end = time.perf_counter()
+
+    # the scene's entities are in the game's spatial hash, so the game renders the ones on screen itself
+    game.render()
+    render_end = time.perf_counter()
+
+    game.present()
+    present_end = time.perf_counter()
+    game.profiler.end_frame()
+
+    if timings is not None:
+        timings["simulation"].append(simulation_end - start)
+        timings["entities"].append(entities_end - simulation_end)
+        timings["render"].append(render_end - entities_end)
+        timings["present"].append(present_end - render_end)
+        timings["frame"].append(present_end - start)
+        # the finer grained scopes Game itself reports through its profiler
+        for name, duration in game.profiler.last_frame.items():
+            timings.setdefault(name, []).append(duration)
+
+def get_percentiles(samples: list) -> dict:
+    samples_ms = np.asarray(samples) * 1000
+    return {"mean": float(samples_ms.mean()), "p50": float(np.percentile(samples_ms, 50)), "p95": float(np.percentile(samples_ms, 95)), "p99": float(np.percentile(samples_ms, 99)), "max": float(samples_ms.max())}
+
+def measure_memory(scene: dict, seed: int, frames: int) -> dict:
+    # a separate run with tracemalloc on, it slows everything down too much to share a run with the timings
+    tracemalloc.start()
+    game, scene_data = create_game(scene, seed)
+    for frame in range(frames):
+        run_frame(game, scene_data, frame, None)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    memory = {}
+    for statistic in snapshot.statistics("filename"):
+        file_name = os.path.basename(statistic.traceback[0].filename)
+        if os.path.exists(file_name):
+            memory[file_name.removesuffix(".py")] = statistic.size
+    memory = dict(sorted(memory.items(), key=lambda item: -item[1]))
+
+    # surface pixels are allocated by SDL and do not show up in tracemalloc
+    memory["tile_chunk_surfaces"] = game.tilemap.render_cache.size_bytes
+    return memory
+
+def run_scene(name: str, frames: int, warmup: int, seed: int, memory_frames: int) -> dict:
+    scene = SCENES[name]
+    game, scene_data = create_game(scene, seed)
+
+    for frame in range(warmup):
+        run_frame(game, scene_data, frame, None)
+
+    timings = {"frame": [], "simulation": [], "entities": [], "render": [], "present": []}
+    for frame in range(warmup, warmup + frames):
+        run_frame(game, scene_data, frame, timings)
+
+    result = {
+        "frames": frames,
+        "frame_ms": get_percentiles(timings.pop("frame")),
+        "subsystems_ms": {subsystem: get_percentiles(samples) for subsystem, samples in timings.items()},
+        "tiles": game.tilemap.tile_count,
+        "entities": len(scene_data["entities"]) + 1,
+        "particles": len(game.particles),
+    }
+    if memory_frames:
+        result["memory_bytes"] = measure_memory(scene, seed, memory_frames)
+    return result
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_comparison(results: dict, baseline_path: str) -> None:
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+
+    print(f"\ncompared to {baseline_path} ({baseline.get('commit')}):")
+    for name, scene_result in results["scenes"].items():
+        baseline_scene = baseline["scenes"].get(name)
+        if not baseline_scene: continue
+        for percentile in ("p50", "p95", "p99"):
+            old = baseline_scene["frame_ms"][percentile]
+            new = scene_result["frame_ms"][percentile]
+            print(f"{name:>20} {percentile}: {old:8.2f} ms -> {new:8.2f} ms ({(new - old) / old * 100:+.1f}%)")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run scripted stress scenes headlessly and report frame time percentiles.")
+    parser.add_argument("--scenes", nargs="+", choices=list(SCENES), default=list(SCENES))
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--warmup", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory-frames", type=int, default=120, help="frames to run with tracemalloc on, 0 skips the memory measurement")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="a results file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    pygame.init()
+    results = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "scenes": {},
+    }
+
+    for name in args.scenes:
+        scene_result = run_scene(name, args.frames, args.warmup, args.seed, args.memory_frames)
+        results["scenes"][name] = scene_result
+        frame_ms = scene_result["frame_ms"]
+        print(f"{name:>20}: p50 {frame_ms['p50']:7.2f} ms  p95 {frame_ms['p95']:7.2f} ms  p99 {frame_ms['p99']:7.2f} ms", file=sys.stderr)
+
+    output_path = os.path.join(LAUNCH_DIRECTORY, args.output)
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"results written to {output_path}")
+
+    if args.compare:
+        print_comparison(results, os.path.join(LAUNCH_DIRECTORY, args.compare))
+
+
+if __name__ == "__main__":
+    main()
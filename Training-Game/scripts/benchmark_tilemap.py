@@ -0,0 +1,199 @@
+import math
+import pygame
+import argparse
+import random
+import time
+import tracemalloc
+from types import SimpleNamespace
+from array import array
+from typing import List
+
+from tilemap import Tilemap, NEIGHBOURING_TILES, PHYSICS_TILES, CHUNK_AREA, EMPTY_TILE
+
+# the string keyed dict backend Tilemap used before the chunked storage, kept here so the two can be compared
+class Legacy_Tilemap:
+    def __init__(self, game: any, tile_size: int) -> None:
+        self.game = game
+        self.tile_size = tile_size
+        self.tile_map = {}
+        self.offgrid_tiles = []
+
+    def set_tile(self, tile_position: tuple | list, tile_type: str, variant: int = 0) -> None:
+        self.tile_map[f"{tile_position[0]};{tile_position[1]}"] = {"type": tile_type, "variant": variant, "position": tuple(tile_position)}
+
+    def get_tile_in_direction(self, position: tuple | list, direction: tuple | list, max_tile_range: int = 20) -> dict | None:
+        tile_position = [int(position[0] // self.tile_size), int(position[1] // self.tile_size)]
+        for _ in range(max_tile_range):
+            tile_position[0] += direction[0]
+            tile_position[1] += direction[1]
+            tile_key = f"{tile_position[0]};{tile_position[1]}"
+            if tile_key in self.tile_map:
+                return self.tile_map[tile_key]
+
+    def get_tiles_around(self, position: tuple | list) -> List[dict]:
+        tile_position = (int(position[0] // self.tile_size), int(position[1] // self.tile_size))
+        tiles = []
+        for neighbour_tile_position in NEIGHBOURING_TILES:
+            tile_key = f"{tile_position[0] + neighbour_tile_position[0]};{tile_position[1] + neighbour_tile_position[1]}"
+            if tile_key in self.tile_map:
+                tiles.append(self.tile_map[tile_key])
+        return tiles
+
+    def get_physics_rects_around(self, position: tuple | list) -> List[pygame.Rect]:
+        rects = []
+        for tile in self.get_tiles_around(position):
+            if tile["type"] in PHYSICS_TILES:
+                rects.append(pygame.Rect(tile["position"][0] * self.tile_size, tile["position"][1] * self.tile_size, self.tile_size, self.tile_size))
+        return rects
+
+    def render(self, render_surface: pygame.Surface, offset = (0, 0)) -> None:
+        for x in range(offset[0] // self.tile_size, (offset[0] + render_surface.get_width()) // self.tile_size + 1):
+            for y in range(offset[1] // self.tile_size, (offset[1] + render_surface.get_height()) // self.tile_size + 1):
+                tile_key = f"{x};{y}"
+                if tile_key in self.tile_map:
+                    tile = self.tile_map[tile_key]
+                    render_surface.blit(self.game.assets[tile["type"]][tile["variant"]], (tile["position"][0] * self.tile_size - offset[0], tile["position"][1] * self.tile_size - offset[1]))
+
+def create_tilemap(tilemap_class: type, game: any, tile_size: int, size: int, fill: float, seed: int) -> tuple:
+    rng = random.Random(seed)
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    if tilemap_class is Tilemap:
+        tilemap = Tilemap(game, tile_size)
+        tilemap.clear()
+    else:
+        tilemap = tilemap_class(game, tile_size)
+
+    for x in range(size):
+        for y in range(size):
+            if rng.random() < fill:
+                tilemap.set_tile((x, y), "grass")
+
+    build_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return tilemap, build_time, memory
+
+def time_queries(tilemap: any, positions: list, offsets: list, render_surface: pygame.Surface) -> dict:
+    results = {}
+
+    start = time.perf_counter()
+    for position in positions:
+        tilemap.get_tiles_around(position)
+    results["get_tiles_around"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for position in positions:
+        tilemap.get_physics_rects_around(position)
+    results["get_physics_rects_around"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i, position in enumerate(positions):
+        tilemap.get_tile_in_direction(position, (0, -1 if i % 2 else 1))
+    results["get_tile_in_direction"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for offset in offsets:
+        tilemap.render(render_surface, offset=offset)
+    results["render"] = time.perf_counter() - start
+
+    return results
+
+def measure_memory(game: any, tile_size: int, tile_count: int, legacy_limit: int) -> dict:
+    # bytes per tile of a solid square of tile_count tiles. chunks are loaded whole like the level streamer does it, setting 10M
+    # tiles one at a time would take minutes. "tiles" is only the tile storage, "indexes" is what the static geometry and the ray
+    # query index add on top of it once they are built
+    results = {}
+    tilemap = Tilemap(game, tile_size)
+    tilemap.clear()
+    type_id = tilemap.get_type_id("grass")
+    number_of_chunks = math.ceil(tile_count / CHUNK_AREA)
+    chunks_per_row = math.ceil(math.sqrt(number_of_chunks))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for chunk_index in range(number_of_chunks):
+        tiles_in_chunk = min(tile_count - chunk_index * CHUNK_AREA, CHUNK_AREA)
+        types = array("H", [type_id]) * tiles_in_chunk + array("H", [EMPTY_TILE]) * (CHUNK_AREA - tiles_in_chunk)
+        tilemap.load_chunk(divmod(chunk_index, chunks_per_row), types, array("H", [0]) * CHUNK_AREA)
+    results["tiles"] = tracemalloc.get_traced_memory()[0] / tile_count
+    results["tiles_time"] = time.perf_counter() - start
+
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    tilemap.compile()
+    results["indexes"] = (tracemalloc.get_traced_memory()[0] - before) / tile_count
+    results["indexes_time"] = time.perf_counter() - start
+    tracemalloc.stop()
+    assert tilemap.tile_count == tile_count
+    del tilemap
+
+    if tile_count <= legacy_limit:
+        tracemalloc.start()
+        start = time.perf_counter()
+        tilemap = Legacy_Tilemap(game, tile_size)
+        side = math.ceil(math.sqrt(tile_count))
+        for index in range(tile_count):
+            tilemap.set_tile(divmod(index, side), "grass")
+        results["legacy"] = tracemalloc.get_traced_memory()[0] / tile_count
+        results["legacy_time"] = time.perf_counter() - start
+        tracemalloc.stop()
+        del tilemap
+    return results
+
+def run_memory_benchmark(game: any, tile_size: int, tile_counts: list, legacy_limit: int) -> None:
+    for tile_count in tile_counts:
+        results = measure_memory(game, tile_size, tile_count, legacy_limit)
+        line = f"{tile_count:>10} tiles: chunked {results['tiles']:6.2f} B/tile ({results['tiles_time']:.2f}s), indexes +{results['indexes']:6.2f} B/tile ({results['indexes_time']:.2f}s)"
+        if "legacy" in results:
+            line += f", legacy {results['legacy']:7.2f} B/tile ({results['legacy_time']:.2f}s, {results['legacy'] / results['tiles']:.0f}x)"
+        print(line)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the legacy string keyed Tilemap storage with the chunked storage.")
+    parser.add_argument("--size", type=int, default=1000, help="the map is size x size tiles (default 1000, 1M tiles)")
+    parser.add_argument("--fill", type=float, default=1.0, help="fraction of cells that contain a tile")
+    parser.add_argument("--queries", type=int, default=100000)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory", action="store_true", help="report bytes per tile instead of timing queries")
+    parser.add_argument("--memory-tiles", type=int, nargs="+", default=[100_000, 10_000_000], help="tile counts measured by --memory")
+    parser.add_argument("--legacy-limit", type=int, default=1_000_000, help="--memory skips the legacy storage above this many tiles")
+    args = parser.parse_args()
+
+    tile_size = 32
+    tile_surface = pygame.Surface((tile_size, tile_size))
+    tile_surface.fill((0, 180, 0))
+    game = SimpleNamespace(assets={"grass": [tile_surface]})
+    render_surface = pygame.Surface((1150, 650))
+
+    if args.memory:
+        run_memory_benchmark(game, tile_size, args.memory_tiles, args.legacy_limit)
+        return
+
+    rng = random.Random(args.seed)
+    world_size = args.size * tile_size
+    positions = [(rng.random() * world_size, rng.random() * world_size) for _ in range(args.queries)]
+    # the camera pans across the map a few pixels per frame like it does in game, so chunk surfaces get reused between frames
+    camera_start = (rng.randrange(0, max(world_size // 2, 1)), rng.randrange(0, max(world_size // 2, 1)))
+    offsets = [(camera_start[0] + frame * 5, camera_start[1] + frame * 3) for frame in range(args.frames)]
+
+    print(f"{args.size}x{args.size} map, fill {args.fill}, {args.queries} queries, {args.frames} rendered frames")
+    results = {}
+    for name, tilemap_class in (("legacy", Legacy_Tilemap), ("chunked", Tilemap)):
+        tilemap, build_time, memory = create_tilemap(tilemap_class, game, tile_size, args.size, args.fill, args.seed)
+        results[name] = time_queries(tilemap, positions, offsets, render_surface)
+        print(f"{name:>8}: build {build_time:.2f}s, {memory / 1024 / 1024:.1f} MiB")
+        del tilemap
+
+    for query in results["legacy"]:
+        legacy = results["legacy"][query]
+        chunked = results["chunked"][query]
+        count = args.frames if query == "render" else args.queries
+        print(f"{query:>26}: legacy {legacy / count * 1e6:9.2f} us  chunked {chunked / count * 1e6:9.2f} us  ({legacy / chunked:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
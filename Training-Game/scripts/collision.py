@@ -0,0 +1,72 @@
+import pygame
+import numpy as np
+
+class Collision_World:
+    def __init__(self, tilemap: any) -> None:
+        self.tilemap = tilemap
+        # scratch objects shared by every query, resolving a collision does not allocate rects or lists per frame
+        self.candidates = []
+        self.entity_rect = pygame.Rect(0, 0, 0, 0)
+        self.hitbox = pygame.Rect(0, 0, 0, 0)
+
+    def resolve(self, x: float, y: float, width: float, height: float, dx: float, dy: float) -> tuple:
+        # moves a box by (dx, dy) against the static geometry, one axis at a time. returns (x, y, top, bottom, left, right)
+        top = bottom = left = right = False
+        entity_rect = self.entity_rect
+        hitbox = self.hitbox
+        candidates = self.candidates
+        get_physics_rects_around = self.tilemap.get_physics_rects_around
+
+        x += dx
+        entity_rect.update(x, y, width, height)
+        hitbox.update(entity_rect)
+        get_physics_rects_around(entity_rect.center, candidates)
+        if candidates:
+            for index in hitbox.collidelistall(candidates):
+                rect = candidates[index]
+                if dx > 0:
+                    entity_rect.right = rect.left
+                    right = True
+                if dx < 0:
+                    entity_rect.left = rect.right
+                    left = True
+                x = entity_rect.x
+
+        y += dy
+        entity_rect.update(x, y, width, height)
+        # the vertical hitbox reaches 4 pixels past the side the entity is moving towards so resting on the ground keeps registering
+        if dy > 0:
+            hitbox.update(entity_rect.left, entity_rect.top, width, height + 4)
+        else:
+            hitbox.update(entity_rect.left, entity_rect.top - 4, width, height)
+        get_physics_rects_around(entity_rect.center, candidates)
+        if candidates:
+            for index in hitbox.collidelistall(candidates):
+                rect = candidates[index]
+                if dy > 0:
+                    entity_rect.bottom = rect.top
+                    bottom = True
+                if dy < 0:
+                    entity_rect.top = rect.bottom
+                    top = True
+                y = entity_rect.y
+
+        return x, y, top, bottom, left, right
+
+    def move_and_collide(self, entity: any, frame_movement: tuple | list) -> None:
+        store = entity.store
+        index = entity.index
+        x, y, *collisions = self.resolve(*store.position[index].tolist(), *store.size[index].tolist(), frame_movement[0], frame_movement[1])
+        store.position[index] = (x, y)
+        store.collisions[index] |= collisions
+
+    def move_and_collide_store(self, store: any, indices: np.ndarray) -> None:
+        # resolves the frame_movement of the given rows of an Entity_Store, the rows are read and written back in one go
+        resolve = self.resolve
+        results = [resolve(x, y, width, height, dx, dy) for (x, y), (width, height), (dx, dy)
+                   in zip(store.position[indices].tolist(), store.size[indices].tolist(), store.frame_movement[indices].tolist())]
+        if not results: return
+
+        results = np.array(results, dtype=np.float64)
+        store.position[indices] = results[:, :2]
+        store.collisions[indices] |= results[:, 2:].astype(bool)
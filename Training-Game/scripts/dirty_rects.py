@@ -0,0 +1,58 @@
+import pygame
+
+class Dirty_Rect_Tracker:
+    def __init__(self, display_size: tuple | list, max_rects: int = 32) -> None:
+        # works out which parts of the display have to be redrawn, by comparing what was drawn on top of the tilemap this frame
+        # with what was drawn last frame. past max_rects the dirty area is redrawn as one rect around all of them
+        self.display_rect = pygame.Rect(0, 0, int(display_size[0]), int(display_size[1]))
+        self.max_rects = max_rects
+
+        self.camera_offset = None
+        self.scene_revision = None
+        self.sprites = None
+        self.sprite_rects = []
+        self.full_redraw_forced = True
+
+    def invalidate(self) -> None:
+        self.camera_offset = None
+
+    def get_sprites(self, blits: list) -> tuple:
+        # (what was drawn, where it was drawn). blit destinations are truncated towards zero, the same as Rect and blit do it
+        sprites = [(surface, int(position[0]), int(position[1])) for surface, position in blits]
+        rects = [pygame.Rect(x, y, surface.get_width(), surface.get_height()) for surface, x, y in sprites]
+        return sprites, rects
+
+    def merge(self, rects: list) -> list:
+        rects = [rect.clip(self.display_rect) for rect in rects]
+        rects = [rect for rect in rects if rect.width and rect.height]
+        if len(rects) > self.max_rects:
+            return [rects[0].unionall(rects[1:])]
+
+        # overlapping rects are joined so no pixel is redrawn twice
+        merged = []
+        for rect in rects:
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def update(self, camera_offset: tuple, scene_revision: int, blits: list, full_redraw: bool = False) -> list | None:
+        # returns None when the whole display has to be redrawn, otherwise the rects to redraw, an empty list when nothing changed.
+        # the camera moving, the scene behind the sprites changing or a full redraw being asked for (this frame or the one before,
+        # so whatever was drawn over everything gets cleaned up again) all redraw the whole display
+        sprites, rects = self.get_sprites(blits)
+        redraw_everything = (full_redraw or self.full_redraw_forced or camera_offset != self.camera_offset or scene_revision != self.scene_revision)
+        previous_rects = self.sprite_rects
+        sprites_changed = sprites != self.sprites
+
+        self.camera_offset = camera_offset
+        self.scene_revision = scene_revision
+        self.sprites = sprites
+        self.sprite_rects = rects
+        self.full_redraw_forced = full_redraw
+
+        if redraw_everything: return None
+        if not sprites_changed: return []
+        return self.merge(previous_rects + rects)
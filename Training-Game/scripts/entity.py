@@ -1,64 +1,113 @@
 import pygame
 import time
 import math 
-import random
+import numpy as np
 
 from tilemap import Tilemap
-from animation import Animation
-from utils import Timer
-from particle import Particle
-from utils import Timer
+from entity_store import COLLISION_SIDES
+from animation import Animation_Clip
+from render_queue import Render_Queue, LAYER_ENTITIES
 
 class Physics_Entity:
+    __slots__ = ("game", "entity_type", "store", "index", "size", "animation_offset", "particle_type", "particle_separation")
+
     def __init__(self, game: any, entity_type: str, position: tuple | list, size: tuple | list, speed: int = 600, graivty: list | tuple = [0, 60]) -> None:
+        # the physics state lives in a row of game.entity_store, the properties below are views into it
         self.game = game
         self.entity_type = entity_type
-        self.position = list(position)
         self.size = size
-        self.speed = speed
-        self.velocity = [0, 0]
-        self.gravity = list(graivty)
-        self.collisions = {"top": False, "bottom": False, "left": False, "right": False}
+        self.store = game.entity_store
+        self.index = self.store.add(self, position, size, speed, graivty, self.game.settings.entities[self.entity_type]["switch_ground_time"])
+        self.game.spatial_hash.move(self, position[0], position[1], size[0], size[1])
 
-        self.action = ""
-        self.flip = [False, False]
         self.animation_offset = [0,0]
-        self.ground_selected = True
-        self.switch_ground_data = {"is_switching": False, "switch_time_ms": self.game.settings.entities[self.entity_type]["switch_ground_time"], 
-                                   "time_between_particle_spawn_ms": None, "end_position": None, "particle_type": f"{self.entity_type}_switch_ground", 
-                                   "particle_separation": 20, "movement_dy": None}
+        self.particle_type = f"{self.entity_type}_switch_ground"
+        self.particle_separation = 20
         self.set_action("idle")
-    
+
+    @property
+    def position(self) -> np.ndarray:
+        return self.store.position[self.index]
+
+    @position.setter
+    def position(self, position: tuple | list) -> None:
+        self.store.position[self.index] = position
+        self.game.spatial_hash.move(self, position[0], position[1], self.size[0], self.size[1])
+
+    @property
+    def previous_position(self) -> np.ndarray:
+        return self.store.previous_position[self.index]
+
+    @property
+    def velocity(self) -> np.ndarray:
+        return self.store.velocity[self.index]
+
+    @velocity.setter
+    def velocity(self, velocity: tuple | list) -> None:
+        self.store.velocity[self.index] = velocity
+
+    @property
+    def gravity(self) -> np.ndarray:
+        return self.store.gravity[self.index]
+
+    @property
+    def speed(self) -> float:
+        return self.store.speed[self.index]
+
+    @property
+    def flip(self) -> np.ndarray:
+        return self.store.flip[self.index]
+
+    @property
+    def collisions(self) -> dict:
+        # a copy, the flags are only written by the collision world
+        return dict(zip(COLLISION_SIDES, self.store.collisions[self.index].tolist()))
+
+    @property
+    def ground_selected(self) -> bool:
+        return bool(self.store.ground_selected[self.index])
+
+    @property
+    def is_switching(self) -> bool:
+        return bool(self.store.is_switching[self.index])
+
+    def remove(self) -> None:
+        self.store.remove(self)
+        self.game.spatial_hash.remove(self)
+
     def get_rect(self) -> pygame.Rect:
         return pygame.Rect(self.position[0], self.position[1], self.size[0], self.size[1])
     
-    def get_hitbox_rects(self, frame_movement: list | tuple) -> dict:
-        frame_movement = list(frame_movement)
-        rect = self.get_rect()
-        hitboxes = {"horizontal": None, "vertical": None}
+    @property
+    def action(self) -> str:
+        return self.game.animation_library.names[self.store.animation_clip[self.index]].split("/", 1)[1]
+
+    @property
+    def animation(self) -> Animation_Clip:
+        return self.game.animation_library.clips[self.store.animation_clip[self.index]]
 
-        hitboxes["horizontal"] = rect
-        hitboxes["vertical"] = pygame.Rect(rect.left, rect.top, rect.width, rect.height+4) if (frame_movement[1] > 0) else pygame.Rect(rect.left, rect.top-4, rect.width, rect.height)
-    
-        return hitboxes
-    
     def set_action(self, action: str) -> None:
-        if action != self.action:
-            self.action = action
-            self.animation: Animation = self.game.assets[f"{self.entity_type}/{self.action}"].copy()
+        # starts the action's clip from its first frame, unless it is already playing
+        clip_id = self.game.animation_library.get_id(f"{self.entity_type}/{action}")
+        if self.store.animation_clip[self.index] != clip_id:
+            self.store.animation_clip[self.index] = clip_id
+            self.store.animation_start_ms[self.index] = self.game.game_clock.time_ms
     
     def switch_ground(self) -> None:
-        if self.switch_ground_data["is_switching"]: return
+        if self.is_switching: return
 
+        store = self.store
+        index = self.index
         rect = self.get_rect()
-        direction = (0, -1 if self.ground_selected else 1)
+        direction = (0, -1 if store.ground_selected[index] else 1)
         tile_size = self.game.tilemap.tile_size
         number_of_rays = max(int(rect.width // self.game.tilemap.tile_size), 2)
         distance_between_rays = rect.width / (number_of_rays - 1)
 
+        # the ground on the other side is searched however far away it is
         tiles = []
         for i in range(number_of_rays):
-            tile = self.game.tilemap.get_tile_in_direction( (int(rect.midleft[0] + distance_between_rays * i - (1 if i == number_of_rays - 1 else 0)), rect.centery), direction)
+            tile = self.game.tilemap.get_tile_in_direction( (int(rect.midleft[0] + distance_between_rays * i - (1 if i == number_of_rays - 1 else 0)), rect.centery), direction, max_tile_range=None)
             if tile: tiles.append(tile)
         
         if not tiles: return
@@ -67,135 +116,158 @@ class Physics_Entity:
 
         if not target_tile: return
 
-        self.switch_ground_data["is_switching"] = True
-        self.switch_ground_data["timer"] = Timer(self.switch_ground_data["switch_time_ms"])
+        store.is_switching[index] = True
+        store.switch_start_ms[index] = np.nan
 
-        self.ground_selected = not self.ground_selected
-        self.gravity[1] *= -1
+        ground_selected = not store.ground_selected[index]
+        store.ground_selected[index] = ground_selected
+        store.gravity[index, 1] *= -1
         
         tile_y_position_pixels = target_tile["position"][1] * tile_size
         
-        if self.ground_selected:
-            end_position = (int(self.position[0]), tile_y_position_pixels)
+        if ground_selected:
+            end_y = tile_y_position_pixels
         else:
-            end_position = (int(self.position[0]), tile_y_position_pixels + tile_size)
-        
-        self.switch_ground_data["end_position"] = end_position
+            end_y = tile_y_position_pixels + tile_size
+        store.switch_end_y[index] = end_y
 
-        self.switch_ground_data["movement_dy"] = (self.switch_ground_data["end_position"][1] - self.position[1]) / self.switch_ground_data["switch_time_ms"]
-        number_of_particles = int(abs(self.switch_ground_data["end_position"][1] - rect.centery) // self.switch_ground_data["particle_separation"]) + 1# can affect where the last particle spawns
-        self.switch_ground_data["time_between_particle_spawn_ms"] = int(self.switch_ground_data["switch_time_ms"] / number_of_particles)
+        switch_time_ms = store.switch_time_ms[index]
+        store.switch_dy[index] = (end_y - store.position[index, 1]) / switch_time_ms
+        number_of_particles = int(abs(end_y - rect.centery) // self.particle_separation) + 1# can affect where the last particle spawns
+        time_between_particle_spawn_ms = int(switch_time_ms / number_of_particles)
 
         start_position = rect.center
         for i in range(number_of_particles):
-            position = (start_position[0], start_position[1] + (i * self.switch_ground_data["particle_separation"] * (1 if self.ground_selected else -1)))
-            particle_velocity = (0, (1 if self.ground_selected else -1) * random.random() * 300)
-            self.game.spawn_particle(Particle(self.game, self.switch_ground_data["particle_type"], position, velocity=particle_velocity), delay=self.switch_ground_data["time_between_particle_spawn_ms"]*i)
-        
+            position = (start_position[0], start_position[1] + (i * self.particle_separation * (1 if ground_selected else -1)))
+            particle_velocity = (0, (1 if ground_selected else -1) * self.game.random.random() * 300)
+            self.game.spawn_particle(self.particle_type, position, velocity=particle_velocity, delay=time_between_particle_spawn_ms*i)
+
+    def spawn_switch_burst(self) -> None:
+        for i in range(20):
+            angle = self.game.random.random() * math.pi * 2
+            speed = self.game.random.random() * 50 + 50
+            particle_velocity = [math.cos(angle) * speed, math.sin(angle) * speed]
+            self.game.spawn_particle(self.particle_type, self.get_rect().center, velocity=particle_velocity)
+
+    def finish_switch(self) -> None:
+        store = self.store
+        index = self.index
+        store.is_switching[index] = False
+        rect = self.get_rect()
+        if store.ground_selected[index]:
+            rect.bottom = int(store.switch_end_y[index])
+        else:
+            rect.top = int(store.switch_end_y[index])
+        store.position[index, 1] = rect.y
     
-    def render(self, render_surface: pygame.Surface, offset = (0,0)) -> None:
-        if not self.switch_ground_data["is_switching"]:
-            render_surface.blit(pygame.transform.flip(self.animation.get_image(), not self.flip[0], self.flip[1]), (self.position[0] - offset[0] + self.animation_offset[0], self.position[1] - offset[1] + self.animation_offset[1]))
+    def get_blit(self, offset = (0,0), interpolation: float = 1.0) -> tuple | None:
+        # (image, destination) for Surface.blit, None while the entity is hidden
+        store = self.store
+        index = self.index
+        if store.is_switching[index]: return None
 
-        # hitboxes = self.get_hitbox_rects(self.frame_movement)
-        # verticle_hitbox = hitboxes["vertical"]
-        # horizontal_hitbox = hitboxes["horizontal"]
-        # pygame.draw.rect(render_surface, (255, 0, 0), pygame.Rect(verticle_hitbox.left - offset[0], verticle_hitbox.top - offset[1], verticle_hitbox.width, verticle_hitbox.height))
-        # pygame.draw.rect(render_surface, (0,255, 0), pygame.Rect(horizontal_hitbox.left - offset[0], horizontal_hitbox.top - offset[1], horizontal_hitbox.width, horizontal_hitbox.height))
+        (x, y), (previous_x, previous_y) = store.position[index].tolist(), store.previous_position[index].tolist()
+        position = (previous_x + (x - previous_x) * interpolation, previous_y + (y - previous_y) * interpolation)
+        flip_x, flip_y = store.flip[index].tolist()
+        image = self.animation.get_image(self.game.game_clock.time_ms - store.animation_start_ms[index], not flip_x, flip_y)
+        return image, (position[0] - offset[0] + self.animation_offset[0], position[1] - offset[1] + self.animation_offset[1])
+
+    def queue_render(self, render_queue: Render_Queue, interpolation: float = 1.0) -> None:
+        blit = self.get_blit((0, 0), interpolation)
+        if blit is not None:
+            render_queue.add(blit[0], blit[1], LAYER_ENTITIES)
+
+    def render(self, render_surface: pygame.Surface, offset = (0,0), interpolation: float = 1.0) -> None:
+        blit = self.get_blit(offset, interpolation)
+        if blit is not None:
+            render_surface.blit(*blit)
 
     def update(self, dt: float, tilemap: Tilemap, movement = (0,0)) -> None:
-        self.collisions = {"top": False, "bottom": False, "left": False, "right": False}
+        # the same step as update_entities, on this entity's row alone
+        store = self.store
+        index = self.index
+        frame_movement = store.begin_update_one(index, dt, movement)
+        tilemap.collision_world.move_and_collide(self, frame_movement)
+        started, finished = store.end_update_one(index, self.game.settings.terminal_velocity, self.game.game_clock.time_ms)
+        if started:
+            self.spawn_switch_burst()
+        if finished:
+            self.finish_switch()
+            self.spawn_switch_burst()
+        store.move_switching_one(index, dt)
+        x, y = store.position[index].tolist()
+        self.game.spatial_hash.move(self, x, y, self.size[0], self.size[1])
+        self.end_update(dt, movement)
 
-        frame_movement = (((movement[0] * self.speed) + self.velocity[0]) * dt, ((movement[1] * self.speed) + self.velocity[1] * dt))
-        self.frame_movement = frame_movement
+    def end_update(self, dt: float, movement = (0,0)) -> None:
+        # the per entity part of a step, after the physics of every entity in the batch has been stepped. animations have nothing
+        # to do here, the frame is worked out from the clip's start time when the entity is drawn
+        pass
 
-        if self.switch_ground_data["is_switching"]: 
-            frame_movement = (0, 0)
-            self.velocity[1] = 0
-        
-        self.position[0] += frame_movement[0]
-        entity_rect = self.get_rect()
-        entity_hitboxes = self.get_hitbox_rects(frame_movement)
-        for rect in tilemap.get_physics_rects_around(entity_rect.center):
-            if entity_hitboxes["horizontal"].colliderect(rect):
-                if frame_movement[0] > 0:
-                    entity_rect.right = rect.left
-                    self.collisions["right"] = True
-                if frame_movement[0] < 0:
-                    entity_rect.left = rect.right
-                    self.collisions["left"] = True
-                self.position[0] = entity_rect.x
-        
-        self.position[1] += frame_movement[1]
-        entity_rect = self.get_rect()
-        entity_hitboxes = self.get_hitbox_rects(frame_movement)
-        for rect in tilemap.get_physics_rects_around(entity_rect.center):
-            if entity_hitboxes["vertical"].colliderect(rect):
-                if frame_movement[1] > 0:
-                    entity_rect.bottom = rect.top
-                    self.collisions["bottom"] = True
-                if frame_movement[1] < 0:
-                    entity_rect.top = rect.bottom
-                    self.collisions["top"] = True
-                self.position[1] = entity_rect.y
-        
-        if self.collisions["top"] or self.collisions["bottom"]:
-            self.velocity[1] = 0
-        
-        if movement[0] > 0:
-            self.flip[0] = False
-        if movement[0] < 0:
-            self.flip[0] = True
-        
-        self.flip[1] = False if self.gravity[1] > 0 else True
-
-        self.velocity[1] = min(max(self.velocity[1] + self.gravity[1], -self.game.settings.terminal_velocity), self.game.settings.terminal_velocity)
-
-        if self.switch_ground_data["is_switching"]:
-            timer = self.switch_ground_data["timer"]
-            if not timer:
-                timer.start()
-                for i in range(20):
-                    angle = random.random() * math.pi * 2
-                    speed = random.random() * 50 + 50
-                    particle_velocity = [math.cos(angle) * speed, math.sin(angle) * speed]
-                    self.game.spawn_particle(Particle(self.game, self.switch_ground_data["particle_type"], self.get_rect().center, velocity=particle_velocity))
-
-            finished = timer.update()
-
-            if finished:
-                self.switch_ground_data["is_switching"] = False
-                rect = self.get_rect()
-                end_position = self.switch_ground_data["end_position"]
-                if self.ground_selected:
-                    rect.bottom = end_position[1]
-                else:
-                    rect.top = end_position[1]
-                self.position[1] = rect.y
-                for i in range(20):
-                    angle = random.random() * math.pi * 2
-                    speed = random.random() * 50 + 50
-                    particle_velocity = [math.cos(angle) * speed, math.sin(angle) * speed]
-                    self.game.spawn_particle(Particle(self.game, self.switch_ground_data["particle_type"], self.get_rect().center, velocity=particle_velocity))
-            else:
-                self.position[1] += self.switch_ground_data["movement_dy"] * (dt*1000)
-            
-        self.animation.update()
 
+def update_entities(entities: list, dt: float, tilemap: Tilemap, movements: list) -> None:
+    # steps every entity in one go: movement, gravity and terminal velocity are done on the whole batch in the entity store,
+    # only collision resolution and the start and end of a gravity switch are handled one entity at a time.
+    # every entity has to be in the same store
+    if not entities: return
+    store = entities[0].store
+    indices = np.fromiter((entity.index for entity in entities), dtype=np.intp, count=len(entities))
+
+    store.begin_update(indices, dt, movements)
+    tilemap.collision_world.move_and_collide_store(store, indices)
+    started, finished = store.end_update(indices, entities[0].game.settings.terminal_velocity, entities[0].game.game_clock.time_ms)
+
+    for i in np.flatnonzero(started | finished).tolist():
+        entity = entities[i]
+        if started[i]:
+            entity.spawn_switch_burst()
+        if finished[i]:
+            entity.finish_switch()
+            entity.spawn_switch_burst()
+    store.move_switching(indices, dt)
+    entities[0].game.spatial_hash.move_many(entities, np.hstack((store.position[indices], store.size[indices])))
+
+    for entity, movement in zip(entities, movements):
+        entity.end_update(dt, movement)
+
+def get_entity_batch(entities: list, interpolation: float = 1.0) -> tuple:
+    # (images, world positions) of the entities that are not hidden, for Render_Queue.add_many. the frames are worked out once
+    # per clip for every entity playing it. every entity has to be in the same store
+    if not entities: return [], np.zeros((0, 2), dtype=np.float64)
+    game = entities[0].game
+    store = entities[0].store
+    indices = np.fromiter((entity.index for entity in entities), dtype=np.intp, count=len(entities))
+    indices = indices[~store.is_switching[indices]]
+    if not len(indices): return [], np.zeros((0, 2), dtype=np.float64)
+
+    previous_position = store.previous_position[indices]
+    positions = previous_position + (store.position[indices] - previous_position) * interpolation
+    flip = store.flip[indices]
+    flipped_images_index = (~flip[:, 0]).astype(np.int32) | (flip[:, 1].astype(np.int32) << 1)
+
+    clips = game.animation_library.clips
+    clip_ids = store.animation_clip[indices]
+    time_elapsed_ms = game.game_clock.time_ms - store.animation_start_ms[indices]
+    image_indices = np.empty(len(indices), dtype=np.int32)
+    for clip_id in np.unique(clip_ids).tolist():
+        playing = clip_ids == clip_id
+        image_indices[playing] = clips[clip_id].get_image_indices(time_elapsed_ms[playing])
+
+    images = [clips[clip_id].flipped_images[flipped][image] for clip_id, flipped, image in zip(clip_ids.tolist(), flipped_images_index.tolist(), image_indices.tolist())]
+    positions += [store.entities[index].animation_offset for index in indices.tolist()]
+    return images, positions
 
 
 class Player(Physics_Entity):
+    __slots__ = ()
+
     def __init__(self, game: any, position: list | tuple, size: list | tuple, speed: float | int = 800) -> None:
         super().__init__(game, "player", position, size, speed=speed)
     
-    def update(self, dt: float, tilemap: Tilemap, movement: list | tuple = (0, 0)) -> None:
-        super().update(dt, tilemap, movement=movement)
+    def end_update(self, dt: float, movement: list | tuple = (0, 0)) -> None:
+        super().end_update(dt, movement=movement)
 
         if movement[0] != 0:
             self.set_action("running")
         else:
-            self.set_action("idle")
-
-        
-
-  
\ No newline at end of file
+            self.set_action("idle")
\ No newline at end of file
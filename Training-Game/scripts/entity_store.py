@@ -0,0 +1,197 @@
+import hashlib
+import numpy as np
+
+# column order of Entity_Store.collisions
+COLLISION_SIDES = ("top", "bottom", "left", "right")
+# every per entity array of Entity_Store that the simulation depends on
+STATE_ARRAYS = ("position", "previous_position", "velocity", "gravity", "size", "speed", "movement", "frame_movement", "collisions", "flip",
+                "ground_selected", "is_switching", "switch_time_ms", "switch_start_ms", "switch_end_y", "switch_dy")
+# what each entity is playing, only used to draw it so it is left out of the state digest
+ANIMATION_ARRAYS = ("animation_clip", "animation_start_ms")
+ROW_ARRAYS = STATE_ARRAYS + ANIMATION_ARRAYS
+
+class Entity_Store:
+    def __init__(self, capacity: int = 256) -> None:
+        # the physics state of every entity, one row per entity. entities only keep their row index, so a view taken from one of
+        # these arrays must not be held on to across adding entities, growing the store reallocates them
+        self.entities = []
+        self.count = 0
+        self.capacity = 0
+        self.position = np.zeros((0, 2), dtype=np.float64)
+        self.previous_position = np.zeros((0, 2), dtype=np.float64)
+        self.velocity = np.zeros((0, 2), dtype=np.float64)
+        self.gravity = np.zeros((0, 2), dtype=np.float64)
+        self.size = np.zeros((0, 2), dtype=np.float64)
+        self.speed = np.zeros(0, dtype=np.float64)
+        # input and resulting movement of the current step
+        self.movement = np.zeros((0, 2), dtype=np.float64)
+        self.frame_movement = np.zeros((0, 2), dtype=np.float64)
+        self.collisions = np.zeros((0, len(COLLISION_SIDES)), dtype=bool)
+        self.flip = np.zeros((0, 2), dtype=bool)
+
+        # gravity switching, switch_start_ms is nan until the switch timer has started
+        self.ground_selected = np.zeros(0, dtype=bool)
+        self.is_switching = np.zeros(0, dtype=bool)
+        self.switch_time_ms = np.zeros(0, dtype=np.float64)
+        self.switch_start_ms = np.zeros(0, dtype=np.float64)
+        self.switch_end_y = np.zeros(0, dtype=np.float64)
+        self.switch_dy = np.zeros(0, dtype=np.float64)
+
+        # id in the game's Animation_Library of the clip playing and the game time it started at, -1 before the first one
+        self.animation_clip = np.zeros(0, dtype=np.int32)
+        self.animation_start_ms = np.zeros(0, dtype=np.float64)
+        self._grow(capacity)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _grow(self, capacity: int) -> None:
+        self.capacity = max(capacity, self.capacity * 2, 1)
+        for name in ROW_ARRAYS:
+            old_array = getattr(self, name)
+            new_array = np.zeros((self.capacity,) + old_array.shape[1:], dtype=old_array.dtype)
+            new_array[:self.count] = old_array[:self.count]
+            setattr(self, name, new_array)
+
+    def get_state_digest(self) -> bytes:
+        # sha1 over the state of every entity, two runs that ended in the same state down to the last bit have the same digest
+        digest = hashlib.sha1()
+        for name in STATE_ARRAYS:
+            digest.update(getattr(self, name)[:self.count].tobytes())
+        return digest.digest()
+
+    def add(self, entity: any, position: tuple | list, size: tuple | list, speed: float, gravity: tuple | list, switch_time_ms: float) -> int:
+        if self.count == self.capacity:
+            self._grow(self.count + 1)
+
+        index = self.count
+        self.position[index] = position
+        self.previous_position[index] = position
+        self.velocity[index] = 0
+        self.gravity[index] = gravity
+        self.size[index] = size
+        self.speed[index] = speed
+        self.movement[index] = 0
+        self.frame_movement[index] = 0
+        self.collisions[index] = False
+        self.flip[index] = False
+        self.ground_selected[index] = True
+        self.is_switching[index] = False
+        self.switch_time_ms[index] = switch_time_ms
+        self.switch_start_ms[index] = np.nan
+        self.switch_end_y[index] = 0
+        self.switch_dy[index] = 0
+        self.animation_clip[index] = -1
+        self.animation_start_ms[index] = 0
+        self.entities.append(entity)
+        self.count += 1
+        return index
+
+    def remove(self, entity: any) -> None:
+        # the last row is moved into the hole, so the entity that owned it gets a new index
+        index = entity.index
+        last = self.count - 1
+        if index != last:
+            for name in ROW_ARRAYS:
+                array = getattr(self, name)
+                array[index] = array[last]
+            moved_entity = self.entities[last]
+            self.entities[index] = moved_entity
+            moved_entity.index = index
+        self.entities.pop()
+        self.count = last
+        entity.index = None
+
+    def begin_update(self, indices: np.ndarray, dt: float, movements: list) -> None:
+        self.previous_position[indices] = self.position[indices]
+        self.collisions[indices] = False
+
+        movement = np.asarray(movements, dtype=np.float64).reshape(-1, 2)
+        self.movement[indices] = movement
+        speed = self.speed[indices]
+        velocity = self.velocity[indices]
+        frame_movement = np.empty((len(indices), 2), dtype=np.float64)
+        frame_movement[:, 0] = (movement[:, 0] * speed + velocity[:, 0]) * dt
+        # the vertical movement input is not scaled by dt, the same as it always was
+        frame_movement[:, 1] = movement[:, 1] * speed + velocity[:, 1] * dt
+
+        # an entity that is switching ground is moved by its switch, not by physics
+        switching = self.is_switching[indices]
+        frame_movement[switching] = 0
+        self.velocity[indices[switching], 1] = 0
+        self.frame_movement[indices] = frame_movement
+
+    def begin_update_one(self, index: int, dt: float, movement: tuple | list) -> tuple:
+        # begin_update for a single row with plain floats, a batch of one pays more in numpy call overhead than the maths costs
+        position = self.position[index].tolist()
+        self.previous_position[index] = position
+        self.collisions[index] = False
+        self.movement[index] = movement
+
+        speed = self.speed[index].item()
+        velocity_x, velocity_y = self.velocity[index].tolist()
+        frame_movement = ((movement[0] * speed + velocity_x) * dt, movement[1] * speed + velocity_y * dt)
+        if self.is_switching[index]:
+            frame_movement = (0.0, 0.0)
+            self.velocity[index, 1] = 0
+        self.frame_movement[index] = frame_movement
+        return frame_movement
+
+    def end_update_one(self, index: int, terminal_velocity: float, time_ms: float) -> tuple:
+        top, bottom, _, _ = self.collisions[index].tolist()
+        velocity_y = 0.0 if top or bottom else self.velocity[index, 1].item()
+
+        movement_x = self.movement[index, 0]
+        flip = self.flip[index]
+        if movement_x > 0:
+            flip[0] = False
+        if movement_x < 0:
+            flip[0] = True
+        gravity_y = float(self.gravity[index, 1])
+        flip[1] = not gravity_y > 0
+
+        self.velocity[index, 1] = min(max(velocity_y + gravity_y, -terminal_velocity), terminal_velocity)
+
+        if not self.is_switching[index]:
+            return False, False
+        started = bool(np.isnan(self.switch_start_ms[index]))
+        if started:
+            self.switch_start_ms[index] = time_ms
+        return started, bool(time_ms - self.switch_start_ms[index] >= self.switch_time_ms[index])
+
+    def end_update(self, indices: np.ndarray, terminal_velocity: float, time_ms: float) -> tuple:
+        # gravity, terminal velocity and facing for every entity at once. returns the (started, finished) masks of the gravity switches
+        # whose timer started or ran out this step, the caller handles those one by one before calling move_switching
+        collisions = self.collisions[indices]
+        velocity_y = self.velocity[indices, 1]
+        velocity_y[collisions[:, 0] | collisions[:, 1]] = 0
+
+        movement_x = self.movement[indices, 0]
+        flip_x = self.flip[indices, 0]
+        flip_x[movement_x > 0] = False
+        flip_x[movement_x < 0] = True
+        self.flip[indices, 0] = flip_x
+        gravity_y = self.gravity[indices, 1]
+        self.flip[indices, 1] = ~(gravity_y > 0)
+
+        self.velocity[indices, 1] = np.clip(velocity_y + gravity_y, -terminal_velocity, terminal_velocity)
+
+        switching = self.is_switching[indices]
+        if not switching.any():
+            return switching, switching
+
+        switch_start_ms = self.switch_start_ms[indices]
+        started = switching & np.isnan(switch_start_ms)
+        switch_start_ms[started] = time_ms
+        self.switch_start_ms[indices] = switch_start_ms
+        with np.errstate(invalid="ignore"):
+            finished = switching & (time_ms - switch_start_ms >= self.switch_time_ms[indices])
+        return started, finished
+
+    def move_switching_one(self, index: int, dt: float) -> None:
+        if self.is_switching[index]:
+            self.position[index, 1] += self.switch_dy[index] * (dt * 1000)
+
+    def move_switching(self, indices: np.ndarray, dt: float) -> None:
+        switching = indices[self.is_switching[indices]]
+        self.position[switching, 1] += self.switch_dy[switching] * (dt * 1000)
@@ -2,110 +2,385 @@ import pygame
 from sys import exit
 import math
 import random
+import time
+import numpy as np
 
 from settings import Settings
-from animation import Animation
-from utils import load_image, load_images, Timer
-from entity import Player
+from animation import Animation_Clip, Animation_Library
+from utils import load_atlases, Game_Clock
+from entity import Player, update_entities, get_entity_batch
+from entity_store import Entity_Store
 from tilemap import Tilemap
-from particle import Particle
+from particle import Particle_System
+from scheduler import Scheduler, Scheduled_Event
+from profiler import Profiler
+from presenter import Presenter
+from dirty_rects import Dirty_Rect_Tracker
+from replay import Replay, encode_input, decode_input
+from level_loader import Chunk_Streamer
+from spatial_hash import Spatial_Hash
+from render_queue import Render_Queue, LAYER_TILES, LAYER_ENTITIES, LAYER_MARKERS
+from quality_governor import Quality_Governor
+from snapshot import take_snapshot, restore_snapshot
+
+# radius of the debug markers drawn where the particles of a ground switch spawn
+MARKER_RADIUS = 5
+
+def get_atlases(settings: Settings) -> dict:
+    # the load_atlas arguments of every animation the game loads
+    return {
+        "particle/explotion": {"path": settings.asset_paths["particles"] + "explotion", "scaling_factor": 2, "colorkey": (0,0,0)},
+        "particle/player_switch_ground": {"path": settings.asset_paths["particles"] + "player_switch_ground", "scaling_factor": 1.5, "colorkey": (0,0,0)},
+        "player/idle": {"path": settings.asset_paths["entities"] + "player/idle", "size": settings.entities["player"]["size"]},
+        "player/running": {"path": settings.asset_paths["entities"] + "player/running", "size": settings.entities["player"]["size"]}
+    }
 
 class Game:
-    def __init__(self, settings: Settings) -> None:
+    def __init__(self, settings: Settings, headless: bool = False) -> None:
         self.settings = settings
-        self.screen = pygame.display.get_surface()
-        self.display = pygame.Surface(self.settings.display_size)
+        self.headless = headless
+        self.screen = None if headless else pygame.display.get_surface()
+        self.presenter = Presenter(self.screen, self.settings.display_size, integer_scaling=self.settings.integer_scaling)
+        self.display = self.presenter.display
+        # the part of the level the camera shows in world pixels, a quality level that shrinks the display draws the same part smaller
+        self.view_size = self.display.get_size()
+        self.dirty_rect_tracker = Dirty_Rect_Tracker(self.settings.display_size) if self.settings.dirty_rect_rendering else None
+        # the rects render() redrew, None when it redrew everything
+        self.dirty_rects = None
+        self.render_queue = Render_Queue()
         self.clock = pygame.time.Clock()
+        self.game_clock = Game_Clock()
         self.target_fps = self.settings.target_fps
+        self.fixed_dt = 1 / self.settings.simulation_rate
+        self.accumulator = 0.0
+        # simulation ticks since the start of the level
+        self.ticks = 0
+        # all gameplay randomness comes from self.random, so a seed and the input of every tick reproduce a run exactly
+        self.seed = self.settings.random_seed if self.settings.random_seed is not None else random.randrange(1 << 63)
+        self.random = random.Random(self.seed)
+        # headless runs have no frames to measure and always run at full quality
+        self.quality_governor = None
+        if self.settings.adaptive_quality and not headless:
+            self.quality_governor = Quality_Governor(1000 / self.target_fps, len(self.settings.quality_levels), window_frames=self.settings.quality_window_frames,
+                                                     degrade_threshold=self.settings.quality_degrade_threshold, restore_threshold=self.settings.quality_restore_threshold,
+                                                     cooldown_frames=self.settings.quality_cooldown_frames)
+        self.quality = self.settings.quality_levels[0]
+        # fractional particles carried over between spawns while particle_scale is below 1
+        self.particle_spawn_credit = 0.0
+        self.profiler = Profiler(enabled=self.settings.profiler_enabled, history_frames=self.settings.profiler_history_frames, frame_budget_ms=1000 / self.target_fps)
 
         def create_surface(size, color) -> None:
             surf = pygame.Surface(size)
             surf.fill(color)
             return surf
 
+        images = load_atlases(get_atlases(self.settings), cache_directory=self.settings.asset_paths["cache"], max_workers=self.settings.asset_loader_threads)
+
         self.assets = {
             "grass": [create_surface((self.settings.tile_size, self.settings.tile_size), (0,180,0))],
-            "particle/explotion": Animation(load_images(self.settings.asset_paths["particles"] + "explotion", scaling_factor=2, colorkey=(0,0,0)), image_duration=50, loop=False),
-            "particle/player_switch_ground": Animation(load_images(self.settings.asset_paths["particles"] + "player_switch_ground", scaling_factor=1.5, colorkey=(0,0,0)), image_duration=50, loop=False),
-            "player/idle": Animation(load_images(self.settings.asset_paths["entities"] + "player/idle", size=self.settings.entities["player"]["size"]), image_duration=150),
-            "player/running": Animation(load_images(self.settings.asset_paths["entities"] + "player/running", size=self.settings.entities["player"]["size"]), image_duration=100)
+            "particle/explotion": Animation_Clip(images["particle/explotion"], image_duration=50, loop=False),
+            "particle/player_switch_ground": Animation_Clip(images["particle/player_switch_ground"], image_duration=50, loop=False),
+            "player/idle": Animation_Clip(images["player/idle"], image_duration=150),
+            "player/running": Animation_Clip(images["player/running"], image_duration=100)
         }
+        # entities only store the id of the clip they are playing and when it started
+        self.animation_library = Animation_Library({name: asset for name, asset in self.assets.items() if isinstance(asset, Animation_Clip)})
         
+        self.marker_surface = create_surface((MARKER_RADIUS * 2 + 1, MARKER_RADIUS * 2 + 1), (255,0,255))
+        pygame.draw.circle(self.marker_surface, (255,0,0), (MARKER_RADIUS, MARKER_RADIUS), MARKER_RADIUS)
+        self.marker_surface.set_colorkey((255,0,255))
+
         self.movment_keys = {"left": {pygame.K_a, pygame.K_LEFT}, "right": {pygame.K_d, pygame.K_RIGHT}}
 
-        self.player = Player(self, (50,50), self.settings.entities["player"]["size"], speed=self.settings.entities["player"]["speed"])
+        self.entity_store = Entity_Store()
+        self.spatial_hash = Spatial_Hash(self.settings.spatial_hash_cell_size)
+        self.player = self.create_player()
         self.player_movement = [False, False]
+        # input is applied at the start of the next tick, not when the key is pressed, so it can be recorded per tick
+        self.switch_ground_requested = False
 
-        self.tilemap = Tilemap(self, self.settings.tile_size)
+        self.world_offset = [0,0]
+        self.previous_world_offset = [0,0]
 
-        self.particles = []
-        self.timed_particles = []
+        self.tilemap = Tilemap(self, self.settings.tile_size, render_cache_bytes=self.settings.tile_render_cache_bytes)
 
-        self.world_offset = [0,0]
+        self.level_streamer = None
+        self.level_streaming = self.settings.level_streaming if self.settings.level_streaming is not None else not headless
+        if self.settings.level_path:
+            self.load_level(self.settings.level_path)
+
+        self.particles = Particle_System(self)
+        self.scheduler = Scheduler(self.game_clock)
 
         self.particle_positions = None
+
+        self.recording = None if headless else self.create_recording()
     
-    def spawn_particle(self, particle: Particle, delay: int = None) -> None:
+    def create_player(self) -> Player:
+        return Player(self, (50,50), self.settings.entities["player"]["size"], speed=self.settings.entities["player"]["speed"])
+
+    def reset(self, seed: int | None = None) -> None:
+        # back to the start of the level, the assets and the tilemap are kept. without a seed the next one comes from self.random
+        self.seed = seed if seed is not None else self.random.randrange(1 << 63)
+        self.random.seed(self.seed)
+        self.game_clock.reset()
+        self.accumulator = 0.0
+        self.ticks = 0
+        self.scheduler.clear()
+        self.particles.clear()
+        self.particle_spawn_credit = 0.0
+
+        self.player.remove()
+        self.player = self.create_player()
+        self.player_movement = [False, False]
+        self.switch_ground_requested = False
+        self.world_offset = [0,0]
+        self.previous_world_offset = [0,0]
+        self.particle_positions = None
+        if self.level_streamer is not None and self.level_streaming:
+            self.level_streamer.unload_all()
+            self.level_streamer.load_around(self.get_camera_rect())
+        if self.recording is not None:
+            self.recording = self.create_recording()
+
+    def create_recording(self) -> Replay:
+        return Replay(self.seed, self.settings.simulation_rate, self.settings.level_path, self.level_streaming and self.level_streamer is not None)
+
+    def load_level(self, level_path: str) -> None:
+        self.tilemap.clear()
+        if self.level_streamer is not None:
+            self.level_streamer.stop()
+        self.level_streamer = Chunk_Streamer(self.tilemap, level_path, load_radius=self.settings.level_load_radius, unload_radius=self.settings.level_unload_radius,
+                                             prefetch_chunks=self.settings.level_prefetch_chunks)
+        if self.level_streaming:
+            self.level_streamer.load_around(self.get_camera_rect())
+        else:
+            self.level_streamer.load_all()
+
+    def get_camera_rect(self) -> tuple:
+        return (self.world_offset[0], self.world_offset[1], self.view_size[0], self.view_size[1])
+
+    def set_quality_level(self, level: int) -> None:
+        quality = self.settings.quality_levels[level]
+        # without hardware scaling the presenter already stretches the display over the screen, a smaller display makes that
+        # stretch bigger and it costs more than drawing less saves, so display_scale is only used when SDL does the scaling
+        display_scale = quality["display_scale"] if self.settings.hardware_scaling else 1.0
+        if display_scale != self.render_queue.scale:
+            # the camera still shows view_size of the level, drawn scaled down into the smaller display
+            self.presenter.set_display_size((self.settings.display_size[0] * display_scale, self.settings.display_size[1] * display_scale))
+            self.display = self.presenter.display
+            self.render_queue.set_scale(display_scale)
+            self.tilemap.set_render_scale(display_scale)
+            if self.dirty_rect_tracker is not None:
+                self.dirty_rect_tracker = Dirty_Rect_Tracker(self.display.get_size())
+        self.quality = quality
+
+    def spawn_particle(self, particle_type: str, position: list | tuple, velocity: list | tuple = (0, 0), delay: int = None) -> Scheduled_Event | None:
+        # at a lower particle_scale only that share of the particles is spawned, callers still draw all their random numbers so
+        # the quality level never changes what the seed produces
+        particle_scale = self.quality["particle_scale"]
+        if particle_scale < 1:
+            self.particle_spawn_credit += particle_scale
+            if self.particle_spawn_credit < 1: return
+            self.particle_spawn_credit -= 1
+
         if not delay:
-            particle.activate()
-            self.particles.append(particle)
+            self.particles.spawn(particle_type, position, velocity)
             return
 
-        timer = Timer(delay)
-        timer.start()
-
-        timed_particle_data = {"particle": particle, "timer": timer}
-        self.timed_particles.append(timed_particle_data)
+        return self.scheduler.schedule(delay, self.particles.spawn, particle_type, tuple(position), tuple(velocity))
     
+    def handle_events(self) -> None:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                if self.settings.replay_record_path:
+                    self.save_recording(self.settings.replay_record_path)
+                pygame.quit()
+                quit()
+            if event.type == pygame.KEYDOWN:
+                if event.key in self.movment_keys["left"]:
+                    self.player_movement[0] = True
+                if event.key in self.movment_keys["right"]:
+                    self.player_movement[1] = True
+                if event.key == pygame.K_SPACE and not self.game_clock.paused:
+                    self.switch_ground_requested = True
+                if event.key == pygame.K_p:
+                    self.game_clock.toggle_pause()
+                if event.key == pygame.K_F3:
+                    self.profiler.toggle_overlay()
+                if event.key == pygame.K_F4 and self.profiler.enabled:
+                    self.profiler.export_chrome_trace(f"frame_trace_{time.strftime('%Y%m%d_%H%M%S')}.json")
+                if event.key == pygame.K_F5:
+                    self.save_recording(f"replay_{time.strftime('%Y%m%d_%H%M%S')}.gbreplay")
+
+            if event.type == pygame.KEYUP:
+                if event.key in self.movment_keys["left"]:
+                    self.player_movement[0] = False
+                if event.key in self.movment_keys["right"]:
+                    self.player_movement[1] = False
+
+    def update(self, dt: float) -> None:
+        self.previous_world_offset = list(self.world_offset)
+        self.world_offset[0] += (self.player.get_rect().centerx - self.view_size[0] / 2 - self.world_offset[0]) * 5 * dt
+        self.world_offset[1] += (self.player.get_rect().centery - self.view_size[1] / 2 - self.world_offset[1]) * 5 * dt
+
+        self.profiler.begin("player_update")
+        self.player.update(dt, self.tilemap, movement = (self.player_movement[1] - self.player_movement[0], 0))
+        self.profiler.end("player_update")
+
+        self.profiler.begin("particles_update")
+        self.scheduler.update()
+        self.particles.update(dt)
+        self.profiler.end("particles_update")
+
+    def update_entities(self, entities: list, movements: list, dt: float) -> None:
+        # steps a batch of entities. the ones outside simulation_active_radius and off screen are frozen: they are not stepped at
+        # all and carry on from where they were once they are back in range, so they fall behind the ones that kept moving
+        radius = self.settings.simulation_active_radius
+        if radius is None or not entities:
+            update_entities(entities, dt, self.tilemap, movements)
+            return
+
+        store = self.entity_store
+        indices = np.fromiter((entity.index for entity in entities), dtype=np.intp, count=len(entities))
+        position = store.position[indices]
+        size = store.size[indices]
+        view_width, view_height = self.view_size
+        camera_centre = (self.world_offset[0] + view_width / 2, self.world_offset[1] + view_height / 2)
+        distances = position + size / 2 - camera_centre
+        active = (distances * distances).sum(axis=1) <= radius * radius
+        # anything that can be on screen steps every tick
+        margin = self.tilemap.tile_size
+        active |= ((position[:, 0] + size[:, 0] > self.world_offset[0] - margin) & (position[:, 0] < self.world_offset[0] + view_width + margin) &
+                   (position[:, 1] + size[:, 1] > self.world_offset[1] - margin) & (position[:, 1] < self.world_offset[1] + view_height + margin))
+        # a gravity switch runs on the game clock, an entity frozen halfway through one would land as soon as it woke up
+        active |= store.is_switching[indices]
+        if active.all():
+            update_entities(entities, dt, self.tilemap, movements)
+            return
+
+        stepping = np.flatnonzero(active).tolist()
+        update_entities([entities[i] for i in stepping], dt, self.tilemap, [movements[i] for i in stepping])
+
+    def get_visible_entities(self, world_offset: tuple) -> list:
+        # entities in the spatial hash cells the camera overlaps. the hash has the position of the last tick, the margin covers
+        # the distance an entity can be drawn away from it when rendering interpolates between two ticks
+        margin = self.tilemap.tile_size
+        return self.spatial_hash.query(world_offset[0] - margin, world_offset[1] - margin, self.view_size[0] + margin * 2, self.view_size[1] + margin * 2)
+
+    def step(self) -> None:
+        input_bits = encode_input(self.player_movement, self.switch_ground_requested)
+        if self.recording is not None:
+            self.recording.record(input_bits)
+
+        if self.switch_ground_requested:
+            self.switch_ground_requested = False
+            self.particle_positions = self.player.switch_ground()
+        self.game_clock.advance(self.fixed_dt)
+        self.ticks += 1
+        self.update(self.fixed_dt)
+
+        # streaming is part of the tick, the tiles the next tick collides with depend only on where the camera is
+        if self.level_streamer is not None and self.level_streaming:
+            self.profiler.begin("level_streaming")
+            camera_velocity = (self.world_offset[0] - self.previous_world_offset[0], self.world_offset[1] - self.previous_world_offset[1])
+            self.level_streamer.update(self.get_camera_rect(), camera_velocity)
+            self.profiler.end("level_streaming")
+
+    def save_recording(self, path: str) -> None:
+        if self.recording is not None:
+            self.recording.save(path, self.entity_store.get_state_digest())
+
+    def run_replay(self, replay: Replay) -> bool:
+        # feeds the recorded input tick by tick, as fast as possible. the game has to be created with the replay's seed, simulation
+        # rate and level. returns whether every entity ended up in exactly the recorded state
+        for input_bits in replay.inputs:
+            self.player_movement, self.switch_ground_requested = decode_input(input_bits)
+            self.step()
+        return self.entity_store.get_state_digest() == replay.state_digest
+
+    def take_snapshot(self) -> bytes:
+        # everything the simulation needs to carry on from this tick, see snapshot.py. the tilemap is shared, not copied.
+        # a callback can not be stored, so the scheduler may only hold delayed particle spawns, anything else raises a ValueError
+        return take_snapshot(self)
+
+    def restore_snapshot(self, snapshot: bytes) -> None:
+        # the game has to have the tilemap and the entities of the game the snapshot was taken from. the recording is cut back to
+        # the tick the snapshot was taken at
+        restore_snapshot(self, snapshot)
+
+    def render(self, interpolation: float = 1.0) -> None:
+        world_offset = (self.previous_world_offset[0] + (self.world_offset[0] - self.previous_world_offset[0]) * interpolation,
+                        self.previous_world_offset[1] + (self.world_offset[1] - self.previous_world_offset[1]) * interpolation)
+        render_world_offset = (int(world_offset[0]), int(world_offset[1]))
+        camera_rect = (render_world_offset[0], render_world_offset[1], self.view_size[0], self.view_size[1])
+
+        # every system queues what it draws in world coordinates, the queue puts all of it on screen in one blits call
+        self.profiler.begin("render_queue")
+        render_queue = self.render_queue
+        render_queue.clear()
+        self.tilemap.queue_render(render_queue, camera_rect)
+        images, positions = get_entity_batch(self.get_visible_entities(render_world_offset), interpolation)
+        render_queue.add_many(images, positions, LAYER_ENTITIES)
+        if self.particle_positions:
+            for position in self.particle_positions:
+                render_queue.add(self.marker_surface, (position[0] - MARKER_RADIUS, position[1] - MARKER_RADIUS), LAYER_MARKERS)
+        self.particles.queue_render(render_queue, camera_rect)
+        # the tiles only change with the camera or the tilemap revision, the dirty rect tracker looks at the rest
+        tile_blits = render_queue.get_blits(render_world_offset, (LAYER_TILES,))
+        sprite_blits = render_queue.get_blits(render_world_offset, [layer for layer in render_queue.layers if layer != LAYER_TILES])
+        self.profiler.end("render_queue")
+
+        self.dirty_rects = None
+        if self.dirty_rect_tracker is not None:
+            self.dirty_rects = self.dirty_rect_tracker.update(render_world_offset, self.tilemap.revision, sprite_blits, full_redraw=self.profiler.overlay_visible)
+
+        self.profiler.begin("render_draw")
+        blits = tile_blits + sprite_blits
+        if self.dirty_rects is None:
+            self.draw(blits)
+        else:
+            for rect in self.dirty_rects:
+                self.display.set_clip(rect)
+                self.draw(blits)
+            self.display.set_clip(None)
+        self.profiler.end("render_draw")
+
+    def draw(self, blits: list) -> None:
+        self.display.fill((255,255,255))
+        self.render_queue.draw(self.display, blits)
+
+    def present(self) -> None:
+        self.profiler.begin("present")
+        self.presenter.present(self.dirty_rects)
+        self.profiler.end("present")
+
     def run(self) -> None:
         while True:
-            dt = self.clock.tick(self.target_fps) / 1000
-            self.world_offset[0] += (self.player.get_rect().centerx - self.display.get_width() / 2 - self.world_offset[0]) * 5 * dt
-            self.world_offset[1] += (self.player.get_rect().centery - self.display.get_height() / 2 - self.world_offset[1]) * 5 * dt
-            render_world_offset = (int(self.world_offset[0]), int(self.world_offset[1]))
-            
-            self.display.fill((255,255,255))
-
-            self.tilemap.render(self.display, offset = render_world_offset)
-                
-            self.player.update(dt, self.tilemap, movement = (self.player_movement[1] - self.player_movement[0], 0))
-            self.player.render(self.display, offset = render_world_offset)
-
-            if self.particle_positions:
-                for position in self.particle_positions:
-                    pygame.draw.circle(self.display, (255,0,0), (position[0]-self.world_offset[0], position[1]-self.world_offset[1]), 5)
-            
-            for timed_particle_data in self.timed_particles:
-                finished = timed_particle_data["timer"].update()
-                if finished: 
-                    timed_particle = timed_particle_data["particle"]
-                    timed_particle.activate()
-                    self.particles.append(timed_particle)
-                    self.timed_particles.remove(timed_particle_data)
-
-            for particle in self.particles:
-                kill = particle.update(dt)
-                particle.render(self.display, self.world_offset)
-                if kill:
-                    self.particles.remove(particle)
-            
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    quit()
-                if event.type == pygame.KEYDOWN:
-                    if event.key in self.movment_keys["left"]:
-                        self.player_movement[0] = True
-                    if event.key in self.movment_keys["right"]:
-                        self.player_movement[1] = True
-                    if event.key == pygame.K_SPACE:
-                        self.particle_positions = self.player.switch_ground()
-
-                if event.type == pygame.KEYUP:
-                    if event.key in self.movment_keys["left"]:
-                        self.player_movement[0] = False
-                    if event.key in self.movment_keys["right"]:
-                        self.player_movement[1] = False
-
-            self.screen.blit(pygame.transform.scale(self.display, self.screen.get_size()), (0,0))
-            pygame.display.update()
+            # the simulation always moves in fixed_dt steps, rendering interpolates between the last two steps with what is left over
+            frame_time = self.game_clock.get_step_time(self.clock.tick(self.target_fps) / 1000)
+            frame_start = time.perf_counter()
+            self.accumulator += min(frame_time, self.settings.max_frame_time)
+            self.profiler.begin_frame()
+
+            self.profiler.begin("events")
+            self.handle_events()
+            self.profiler.end("events")
+
+            while self.accumulator >= self.fixed_dt:
+                self.step()
+                self.accumulator -= self.fixed_dt
+
+            self.render(self.accumulator / self.fixed_dt)
+            if self.profiler.overlay_visible:
+                self.profiler.render_overlay(self.display)
+            self.present()
+            self.profiler.end_frame()
+
+            if self.quality_governor is not None and self.quality_governor.add_frame((time.perf_counter() - frame_start) * 1000):
+                self.set_quality_level(self.quality_governor.level)
+
+    def run_headless(self, steps: int) -> None:
+        # no events, no rendering and no frame cap, the simulation runs as fast as it can
+        for _ in range(steps):
+            self.step()
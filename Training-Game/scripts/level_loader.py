@@ -0,0 +1,351 @@
+import os
+import io
+import sys
+import json
+import gzip
+import mmap
+import zlib
+import queue
+import base64
+import struct
+import argparse
+import threading
+import numpy as np
+from array import array
+import xml.etree.ElementTree as ElementTree
+
+from tilemap import CHUNK_SHIFT, CHUNK_SIZE, CHUNK_AREA, EMPTY_TILE
+from settings import Settings
+
+# binary level layout, all little endian:
+#   header: magic, version, chunk shift, number of tile types, number of chunks
+#   tile types: u16 byte length + utf-8 name + u16 number of variants used, type id i of the file is types[i - 1] (0 is empty)
+#   chunk table: chunk x, chunk y, byte offset of the chunk data, sorted by (x, y)
+#   chunk data: CHUNK_AREA u16 type ids followed by CHUNK_AREA u16 variants per chunk, row major like Tile_Chunk
+LEVEL_MAGIC = b"GBLV"
+LEVEL_VERSION = 2
+HEADER = struct.Struct("<4sHBxII")
+TYPE_NAME_LENGTH = struct.Struct("<H")
+VARIANT_COUNT = struct.Struct("<H")
+CHUNK_TABLE_ENTRY = struct.Struct("<iiQ")
+
+# the top bits of a tiled gid are flip flags, not part of the tile id
+TILED_GID_MASK = 0x0FFFFFFF
+
+def decode_tiled_data(data: str | list, encoding: str | None, compression: str | None) -> np.ndarray:
+    if isinstance(data, list):
+        return np.asarray(data, dtype=np.uint32)
+    if encoding == "csv":
+        return np.array([int(value) for value in data.replace("\n", "").split(",") if value.strip()], dtype=np.uint32)
+
+    raw = base64.b64decode(data.strip())
+    if compression == "zlib":
+        raw = zlib.decompress(raw)
+    elif compression == "gzip":
+        raw = gzip.GzipFile(fileobj=io.BytesIO(raw)).read()
+    elif compression:
+        raise ValueError(f"unsupported tiled layer compression: {compression}")
+    return np.frombuffer(raw, dtype="<u4").astype(np.uint32)
+
+def read_tiled_map(path: str) -> tuple:
+    # returns (tilesets, regions). tilesets is a list of (firstgid, name), regions a list of (tile_x, tile_y, gids) where gids is a 2D array,
+    # one region per finite layer or per chunk of an infinite layer. later regions draw over earlier ones
+    tilesets = []
+    regions = []
+
+    if path.endswith(".tmx"):
+        root = ElementTree.parse(path).getroot()
+        for tileset in root.iter("tileset"):
+            name = tileset.get("name") or os.path.splitext(os.path.basename(tileset.get("source", "")))[0]
+            tilesets.append((int(tileset.get("firstgid")), name))
+
+        for layer in root.iter("layer"):
+            data = layer.find("data")
+            encoding, compression = data.get("encoding"), data.get("compression")
+            chunks = data.findall("chunk")
+            if chunks:
+                for chunk in chunks:
+                    gids = decode_tiled_data(chunk.text, encoding, compression).reshape(int(chunk.get("height")), int(chunk.get("width")))
+                    regions.append((int(chunk.get("x")), int(chunk.get("y")), gids))
+            else:
+                if encoding is None:
+                    gids = np.array([int(tile.get("gid", 0)) for tile in data.findall("tile")], dtype=np.uint32)
+                else:
+                    gids = decode_tiled_data(data.text, encoding, compression)
+                regions.append((0, 0, gids.reshape(int(layer.get("height")), int(layer.get("width")))))
+    else:
+        with open(path) as file:
+            tiled_map = json.load(file)
+        for tileset in tiled_map.get("tilesets", []):
+            name = tileset.get("name") or os.path.splitext(os.path.basename(tileset.get("source", "")))[0]
+            tilesets.append((tileset["firstgid"], name))
+
+        layers = list(tiled_map.get("layers", []))
+        while layers:
+            layer = layers.pop(0)
+            if layer.get("type") == "group":
+                layers[:0] = layer.get("layers", [])
+                continue
+            if layer.get("type") != "tilelayer": continue
+
+            encoding, compression = layer.get("encoding"), layer.get("compression")
+            if "chunks" in layer:
+                for chunk in layer["chunks"]:
+                    gids = decode_tiled_data(chunk["data"], encoding, compression).reshape(chunk["height"], chunk["width"])
+                    regions.append((chunk["x"], chunk["y"], gids))
+            else:
+                gids = decode_tiled_data(layer["data"], encoding, compression).reshape(layer["height"], layer["width"])
+                regions.append((layer.get("startx", 0), layer.get("starty", 0), gids))
+
+    return sorted(tilesets), regions
+
+def convert_tiled_map(source_path: str, destination_path: str, tileset_types: dict) -> int:
+    # converts a tiled map (.tmx or .tmj/.json) to the binary chunk format. tileset_types maps a tileset name to the tile type its
+    # tiles become, the tile's index inside its tileset is the variant. returns the number of chunks written
+    tilesets, regions = read_tiled_map(source_path)
+    regions = [(tile_x, tile_y, gids & TILED_GID_MASK) for tile_x, tile_y, gids in regions]
+
+    # only the tilesets the map actually places tiles from need a tile type
+    tileset_ranges = [(firstgid, next_firstgid, name) for (firstgid, name), (next_firstgid, _) in zip(tilesets, tilesets[1:] + [(TILED_GID_MASK + 1, None)])]
+    used_tilesets = [(firstgid, next_firstgid, name) for firstgid, next_firstgid, name in tileset_ranges
+                     if any(((gids >= firstgid) & (gids < next_firstgid)).any() for _, _, gids in regions)]
+    unknown_tilesets = [name for _, _, name in used_tilesets if name not in tileset_types]
+    if unknown_tilesets:
+        raise ValueError(f"{source_path} uses tilesets without a tile type: {', '.join(unknown_tilesets)}. map them to tile types in Settings.tileset_types or with --tileset NAME=TYPE")
+
+    type_names = []
+    for _, _, name in used_tilesets:
+        tile_type = tileset_types[name]
+        if tile_type in type_names:
+            raise ValueError(f"{source_path} uses more than one tileset mapped to tile type {tile_type}, their variants would overlap")
+        type_names.append(tile_type)
+    variant_counts = [0] * len(type_names)
+
+    chunks = {}
+    for tile_x, tile_y, gids in regions:
+        type_ids = np.zeros(gids.shape, dtype=np.uint16)
+        variants = np.zeros(gids.shape, dtype=np.uint16)
+        for type_index, (firstgid, next_firstgid, _) in enumerate(used_tilesets):
+            in_tileset = (gids >= firstgid) & (gids < next_firstgid)
+            if not in_tileset.any(): continue
+            type_ids[in_tileset] = type_index + 1
+            variants[in_tileset] = gids[in_tileset] - firstgid
+            variant_counts[type_index] = max(variant_counts[type_index], int(variants[in_tileset].max()) + 1)
+        occupied = type_ids != EMPTY_TILE
+
+        height, width = gids.shape
+        for chunk_y in range(tile_y >> CHUNK_SHIFT, ((tile_y + height - 1) >> CHUNK_SHIFT) + 1):
+            for chunk_x in range(tile_x >> CHUNK_SHIFT, ((tile_x + width - 1) >> CHUNK_SHIFT) + 1):
+                # the part of the region that falls inside this chunk
+                start_x = max(chunk_x << CHUNK_SHIFT, tile_x)
+                end_x = min((chunk_x + 1) << CHUNK_SHIFT, tile_x + width)
+                start_y = max(chunk_y << CHUNK_SHIFT, tile_y)
+                end_y = min((chunk_y + 1) << CHUNK_SHIFT, tile_y + height)
+                region_slice = (slice(start_y - tile_y, end_y - tile_y), slice(start_x - tile_x, end_x - tile_x))
+                region_occupied = occupied[region_slice]
+                if not region_occupied.any(): continue
+
+                chunk_types, chunk_variants = chunks.setdefault((chunk_x, chunk_y), (np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint16), np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint16)))
+                chunk_slice = (slice(start_y - (chunk_y << CHUNK_SHIFT), end_y - (chunk_y << CHUNK_SHIFT)), slice(start_x - (chunk_x << CHUNK_SHIFT), end_x - (chunk_x << CHUNK_SHIFT)))
+                chunk_types[chunk_slice][region_occupied] = type_ids[region_slice][region_occupied]
+                chunk_variants[chunk_slice][region_occupied] = variants[region_slice][region_occupied]
+
+    chunk_positions = sorted(chunks)
+    encoded_names = [name.encode("utf-8") for name in type_names]
+    table_offset = HEADER.size + sum(TYPE_NAME_LENGTH.size + len(name) + VARIANT_COUNT.size for name in encoded_names)
+    data_offset = table_offset + CHUNK_TABLE_ENTRY.size * len(chunk_positions)
+    chunk_bytes = CHUNK_AREA * 2 * 2
+
+    with open(destination_path + ".tmp", "wb") as file:
+        file.write(HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, CHUNK_SHIFT, len(type_names), len(chunk_positions)))
+        for name, variant_count in zip(encoded_names, variant_counts):
+            file.write(TYPE_NAME_LENGTH.pack(len(name)))
+            file.write(name)
+            file.write(VARIANT_COUNT.pack(variant_count))
+        for i, chunk_position in enumerate(chunk_positions):
+            file.write(CHUNK_TABLE_ENTRY.pack(chunk_position[0], chunk_position[1], data_offset + i * chunk_bytes))
+        for chunk_position in chunk_positions:
+            chunk_types, chunk_variants = chunks[chunk_position]
+            file.write(chunk_types.astype("<u2").tobytes())
+            file.write(chunk_variants.astype("<u2").tobytes())
+    os.replace(destination_path + ".tmp", destination_path)
+
+    return len(chunk_positions)
+
+class Level_File:
+    def __init__(self, path: str) -> None:
+        # the file is memory mapped, chunk data is only paged in when a chunk is read
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, chunk_shift, number_of_types, number_of_chunks = HEADER.unpack_from(self.data, 0)
+        if magic != LEVEL_MAGIC:
+            raise ValueError(f"{path} is not a level file")
+        if version != LEVEL_VERSION or chunk_shift != CHUNK_SHIFT:
+            raise ValueError(f"{path} is level format {version} with chunk shift {chunk_shift}, expected {LEVEL_VERSION} with {CHUNK_SHIFT}. convert it again")
+
+        offset = HEADER.size
+        self.type_names = []
+        self.variant_counts = []
+        for _ in range(number_of_types):
+            (length,) = TYPE_NAME_LENGTH.unpack_from(self.data, offset)
+            offset += TYPE_NAME_LENGTH.size
+            self.type_names.append(self.data[offset:offset + length].decode("utf-8"))
+            offset += length
+            self.variant_counts.append(VARIANT_COUNT.unpack_from(self.data, offset)[0])
+            offset += VARIANT_COUNT.size
+
+        self.chunk_offsets = {}
+        for chunk_x, chunk_y, chunk_offset in CHUNK_TABLE_ENTRY.iter_unpack(self.data[offset:offset + CHUNK_TABLE_ENTRY.size * number_of_chunks]):
+            self.chunk_offsets[(chunk_x, chunk_y)] = chunk_offset
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
+
+    def check_tile_types(self, assets: dict) -> None:
+        # a level made for other tile assets fails here, instead of when one of its chunks is first drawn
+        for name, variant_count in zip(self.type_names, self.variant_counts):
+            if name not in assets:
+                raise ValueError(f"level uses tile type {name}, which has no assets")
+            if variant_count > len(assets[name]):
+                raise ValueError(f"level uses {variant_count} variants of tile type {name}, its assets only have {len(assets[name])}")
+
+    def read_chunk(self, chunk_position: tuple, type_id_map: np.ndarray) -> tuple | None:
+        # returns (types, variants) as arrays ready for a Tile_Chunk, type_id_map translates the file's type ids to the tilemap's
+        offset = self.chunk_offsets.get(chunk_position)
+        if offset is None: return None
+
+        types = type_id_map[np.frombuffer(self.data, dtype="<u2", count=CHUNK_AREA, offset=offset)]
+        variants = np.frombuffer(self.data, dtype="<u2", count=CHUNK_AREA, offset=offset + CHUNK_AREA * 2)
+        return array("H", types.astype(np.uint16).tobytes()), array("H", variants.astype(np.uint16).tobytes())
+
+class Chunk_Streamer:
+    def __init__(self, tilemap: any, level_path: str, load_radius: int = 1, unload_radius: int = 3, prefetch_chunks: int = 2) -> None:
+        # radii are in chunks around the ones the camera can see, unload_radius > load_radius so chunks on the edge do not thrash
+        self.tilemap = tilemap
+        self.level = Level_File(level_path)
+        try:
+            self.level.check_tile_types(tilemap.game.assets)
+        except ValueError as error:
+            self.level.close()
+            raise ValueError(f"{level_path}: {error}") from None
+        self.load_radius = load_radius
+        self.unload_radius = unload_radius
+        self.prefetch_chunks = prefetch_chunks
+
+        # tile type names are interned on the main thread, the worker only translates ids through this table
+        self.type_id_map = np.array([EMPTY_TILE] + [tilemap.get_type_id(name) for name in self.level.type_names], dtype=np.uint16)
+
+        self.loaded = set()
+        self.pending = set()
+        # chunks the worker has read that are not in the tilemap yet
+        self.ready = {}
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target=self.load_chunks, name="chunk streamer", daemon=True)
+        self.worker.start()
+
+    def load_chunks(self) -> None:
+        while True:
+            chunk_position = self.requests.get()
+            if chunk_position is None: return
+            self.results.put((chunk_position, self.level.read_chunk(chunk_position, self.type_id_map)))
+
+    def stop(self) -> None:
+        self.requests.put(None)
+        self.worker.join()
+        self.level.close()
+
+    def get_chunk_range(self, camera_rect: tuple, radius: int) -> tuple:
+        chunk_pixel_size = CHUNK_SIZE * self.tilemap.tile_size
+        x, y, width, height = camera_rect
+        return (int(x // chunk_pixel_size) - radius, int(y // chunk_pixel_size) - radius,
+                int((x + width - 1) // chunk_pixel_size) + radius, int((y + height - 1) // chunk_pixel_size) + radius)
+
+    def get_wanted_chunks(self, camera_rect: tuple, velocity: tuple | list) -> list:
+        # chunks in view and load_radius around it, plus prefetch_chunks further in the direction the camera is moving,
+        # nearest to the middle of the view first so what is on screen arrives first
+        min_x, min_y, max_x, max_y = self.get_chunk_range(camera_rect, self.load_radius)
+        if velocity[0] > 0: max_x += self.prefetch_chunks
+        if velocity[0] < 0: min_x -= self.prefetch_chunks
+        if velocity[1] > 0: max_y += self.prefetch_chunks
+        if velocity[1] < 0: min_y -= self.prefetch_chunks
+
+        center_x = (min_x + max_x) / 2
+        center_y = (min_y + max_y) / 2
+        chunk_offsets = self.level.chunk_offsets
+        wanted = [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1) if (x, y) in chunk_offsets]
+        wanted.sort(key=lambda chunk_position: abs(chunk_position[0] - center_x) + abs(chunk_position[1] - center_y))
+        return wanted
+
+    def collect_results(self) -> None:
+        while True:
+            try:
+                chunk_position, chunk_data = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.pending.discard(chunk_position)
+            if chunk_position not in self.loaded:
+                self.ready[chunk_position] = chunk_data
+
+    def update(self, camera_rect: tuple, velocity: tuple | list = (0, 0)) -> None:
+        # called after every simulation tick. the worker reads ahead around the camera, but which chunks are in the tilemap only
+        # depends on the camera: every chunk in load_radius is added on the tick it comes in range, read here if the worker has
+        # not got to it yet, and every chunk outside unload_radius is dropped. a replay that streams the level sees the same
+        # tiles on the same ticks however fast the disk was
+        for chunk_position in self.get_wanted_chunks(camera_rect, velocity):
+            if chunk_position not in self.loaded and chunk_position not in self.pending and chunk_position not in self.ready:
+                self.pending.add(chunk_position)
+                self.requests.put(chunk_position)
+
+        self.collect_results()
+        self.load_around(camera_rect)
+
+        min_x, min_y, max_x, max_y = self.get_chunk_range(camera_rect, self.unload_radius)
+        for chunk_position in sorted(self.loaded):
+            if not (min_x <= chunk_position[0] <= max_x and min_y <= chunk_position[1] <= max_y):
+                self.loaded.discard(chunk_position)
+                self.tilemap.unload_chunk(chunk_position)
+        for chunk_position in list(self.ready):
+            if not (min_x <= chunk_position[0] <= max_x and min_y <= chunk_position[1] <= max_y):
+                del self.ready[chunk_position]
+
+    def load_around(self, camera_rect: tuple) -> None:
+        # blocking load of everything in load_radius of camera_rect that is not in the tilemap yet
+        for chunk_position in self.get_wanted_chunks(camera_rect, (0, 0)):
+            if chunk_position not in self.loaded:
+                chunk_data = self.ready.pop(chunk_position) if chunk_position in self.ready else self.level.read_chunk(chunk_position, self.type_id_map)
+                if chunk_data is not None:
+                    self.tilemap.load_chunk(chunk_position, *chunk_data)
+                self.loaded.add(chunk_position)
+
+    def unload_all(self) -> None:
+        for chunk_position in sorted(self.loaded):
+            self.tilemap.unload_chunk(chunk_position)
+        self.loaded.clear()
+
+    def load_all(self) -> None:
+        # blocking load of the whole level, for games that do not stream it
+        for chunk_position in self.level.chunk_offsets:
+            if chunk_position not in self.loaded:
+                self.tilemap.load_chunk(chunk_position, *self.level.read_chunk(chunk_position, self.type_id_map))
+                self.loaded.add(chunk_position)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a Tiled map (.tmx, .tmj or .json) to the binary chunked level format.")
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    parser.add_argument("--tileset", action="append", default=[], metavar="NAME=TYPE", help="tile type for a tileset, on top of Settings.tileset_types")
+    args = parser.parse_args()
+
+    tileset_types = dict(Settings().tileset_types)
+    for mapping in args.tileset:
+        name, separator, tile_type = mapping.partition("=")
+        if not separator:
+            parser.error(f"--tileset takes NAME=TYPE, got {mapping}")
+        tileset_types[name] = tile_type
+
+    number_of_chunks = convert_tiled_map(args.source, args.destination, tileset_types)
+    print(f"wrote {number_of_chunks} chunks to {args.destination}", file=sys.stderr)
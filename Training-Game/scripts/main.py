@@ -1,20 +1,68 @@
 import pygame
+import os
+import time
+import argparse
 
 from game import Game
 from settings import Settings
+from replay import Replay
 
 class Main:
-    def __init__(self) -> None:
+    def __init__(self, headless: bool = False, level_path: str | None = None, replay_path: str | None = None, record_path: str | None = None) -> None:
+        self.headless = headless
+        if headless:
+            # has to be set before the video system is initialised, the dummy driver never opens a window
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
         pygame.init()
         self.settings = Settings()
-        self.screen = pygame.display.set_mode(self.settings.screen_size)
+        if level_path:
+            self.settings.level_path = level_path
+        if record_path:
+            self.settings.replay_record_path = record_path
+
+        # a replay runs with the seed, simulation rate and level it was recorded with, loaded the way it was loaded then
+        self.replay = Replay.load(replay_path) if replay_path else None
+        if self.replay is not None:
+            self.settings.random_seed = self.replay.seed
+            self.settings.simulation_rate = self.replay.simulation_rate
+            self.settings.level_path = self.replay.level_path
+            self.settings.level_streaming = self.replay.level_streaming
+
+        if headless:
+            self.screen = None
+        elif self.settings.hardware_scaling:
+            self.screen = pygame.display.set_mode(self.settings.display_size, pygame.SCALED)
+        else:
+            self.screen = pygame.display.set_mode(self.settings.screen_size)
 
-        self.game = Game(self.settings)
+        self.game = Game(self.settings, headless=headless)
 
-    def run(self) -> None:
-        self.game.run()
+    def run(self, steps: int = 0) -> None:
+        if not self.headless:
+            self.game.run()
+            return
+
+        start_time = time.perf_counter()
+        if self.replay is not None:
+            steps = len(self.replay)
+            matched = self.game.run_replay(self.replay)
+        else:
+            self.game.run_headless(steps)
+        time_taken = time.perf_counter() - start_time
+        print(f"{steps} steps in {time_taken:.3f}s ({steps / max(time_taken, 1e-9):.0f} steps/s, {steps * self.game.fixed_dt / max(time_taken, 1e-9):.0f}x real time)")
+        if self.replay is not None:
+            print("replay matched the recorded state" if matched else "replay DIVERGED from the recorded state")
 
 
 if __name__ == "__main__":
-    main = Main()
-    main.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true", help="run the simulation without a window, rendering or frame cap")
+    parser.add_argument("--steps", type=int, default=6000, help="number of simulation steps to run in headless mode")
+    parser.add_argument("--level", help="a level converted with level_loader.py, instead of the built in test level")
+    parser.add_argument("--replay", help="replay a recorded .gbreplay file headlessly as fast as possible and check it ends in the recorded state")
+    parser.add_argument("--record", help="save the input of the session to this replay file on quit")
+    args = parser.parse_args()
+
+    main = Main(headless=args.headless or args.replay is not None, level_path=args.level, replay_path=args.replay, record_path=args.record)
+    main.run(steps=args.steps)
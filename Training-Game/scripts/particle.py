@@ -1,35 +1,145 @@
 import pygame
+import numpy as np
 
-from animation import Animation
+from animation import Animation_Clip
+from render_queue import Render_Queue, LAYER_PARTICLES
 
-class Particle:
-    def __init__(self, game: any, particle_type: str, particle_position: list | tuple, velocity: list | tuple = [0, 0]) -> None:
+# every per particle array of Particle_System
+PARTICLE_ARRAYS = ("position", "velocity", "spawn_time", "lifetime", "type_id")
+
+class Particle_System:
+    def __init__(self, game: any, capacity: int = 1024) -> None:
         self.game = game
-        self.particle_type = particle_type
-        self.particle_position = list(particle_position)
-        self.velocity = list(velocity)
-        self.active = False
-    
-    def activate(self) -> None:
-        self.animation: Animation = self.game.assets[f"particle/{self.particle_type}"].copy()
-        self.active = True
-    
-    def render(self, render_surface: pygame.Surface, offset = (0, 0)) -> None:
-        image = self.animation.get_image()
-        render_surface.blit(image, (self.particle_position[0] - offset[0] - image.get_width() // 2, self.particle_position[1] - offset[1] - image.get_height() // 2))
+        self.clock = game.game_clock
+
+        # per particle type data, the frames of every type are stored back to back in one list
+        self.particle_type_ids = {}
+        self.type_first_frame = []
+        self.type_number_of_frames = []
+        self.type_image_duration = []
+        self.frames = []
+        self.frame_half_sizes = np.zeros((0, 2), dtype=np.int32)
+
+        self.count = 0
+        self.capacity = 0
+        self.position = np.zeros((0, 2), dtype=np.float64)
+        self.velocity = np.zeros((0, 2), dtype=np.float64)
+        self.spawn_time = np.zeros(0, dtype=np.float64)
+        self.lifetime = np.zeros(0, dtype=np.float64)
+        self.type_id = np.zeros(0, dtype=np.int32)
+        self._grow(capacity)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _grow(self, capacity: int) -> None:
+        self.capacity = max(capacity, self.capacity * 2, 1)
+        for name in PARTICLE_ARRAYS:
+            old_array = getattr(self, name)
+            new_array = np.zeros((self.capacity,) + old_array.shape[1:], dtype=old_array.dtype)
+            new_array[:self.count] = old_array[:self.count]
+            setattr(self, name, new_array)
+
+    def reserve(self, capacity: int) -> None:
+        # room for at least capacity particles without growing again, the arrays are reallocated if they are too small
+        if capacity > self.capacity:
+            self._grow(capacity)
+
+    def get_type_id(self, particle_type: str) -> int:
+        type_id = self.particle_type_ids.get(particle_type)
+        if type_id is not None:
+            return type_id
+
+        animation: Animation_Clip = self.game.assets[f"particle/{particle_type}"]
+        type_id = len(self.type_first_frame)
+        self.particle_type_ids[particle_type] = type_id
+        self.type_first_frame.append(len(self.frames))
+        self.type_number_of_frames.append(animation.number_of_images)
+        self.type_image_duration.append(animation.image_duration / 1000)
+        self.frames.extend(animation.images)
+        half_sizes = np.array([(image.get_width() // 2, image.get_height() // 2) for image in animation.images], dtype=np.int32)
+        self.frame_half_sizes = np.concatenate((self.frame_half_sizes, half_sizes))
+        return type_id
+
+    def spawn(self, particle_type: str, position: list | tuple, velocity: list | tuple = (0, 0)) -> None:
+        type_id = self.get_type_id(particle_type)
+        if self.count == self.capacity:
+            self._grow(self.count + 1)
 
-    def update(self, dt: float) -> bool:
+        index = self.count
+        self.position[index] = position
+        self.velocity[index] = velocity
+        self.spawn_time[index] = self.clock.time_ms / 1000
+        self.lifetime[index] = self.type_number_of_frames[type_id] * self.type_image_duration[type_id]
+        self.type_id[index] = type_id
+        self.count += 1
 
-        kill = False
-        if self.animation.done:
-            kill = True
-            self.active = False
+    def spawn_many(self, particle_type: str, positions: np.ndarray, velocities: np.ndarray) -> None:
+        type_id = self.get_type_id(particle_type)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        number_of_particles = len(positions)
+        if self.count + number_of_particles > self.capacity:
+            self._grow(self.count + number_of_particles)
 
-        self.particle_position[0] += self.velocity[0] * dt
-        self.particle_position[1] += self.velocity[1] * dt
+        start, end = self.count, self.count + number_of_particles
+        self.position[start:end] = positions
+        self.velocity[start:end] = velocities
+        self.spawn_time[start:end] = self.clock.time_ms / 1000
+        self.lifetime[start:end] = self.type_number_of_frames[type_id] * self.type_image_duration[type_id]
+        self.type_id[start:end] = type_id
+        self.count = end
 
-        self.animation.update()
+    def clear(self) -> None:
+        self.count = 0
 
-        return kill
+    def update(self, dt: float) -> None:
+        count = self.count
+        if not count: return
 
-        
\ No newline at end of file
+        self.position[:count] += self.velocity[:count] * dt
+
+        alive = (self.clock.time_ms / 1000 - self.spawn_time[:count]) < self.lifetime[:count]
+        number_alive = int(np.count_nonzero(alive))
+        if number_alive != count:
+            for name in PARTICLE_ARRAYS:
+                array = getattr(self, name)
+                array[:number_alive] = array[:count][alive]
+            self.count = number_alive
+
+    def get_frame_indices(self) -> np.ndarray:
+        count = self.count
+        type_ids = self.type_id[:count]
+        image_durations = np.asarray(self.type_image_duration)[type_ids]
+        frame = ((self.clock.time_ms / 1000 - self.spawn_time[:count]) // image_durations).astype(np.int32)
+        frame = np.minimum(frame, np.asarray(self.type_number_of_frames, dtype=np.int32)[type_ids] - 1)
+        return np.asarray(self.type_first_frame, dtype=np.int32)[type_ids] + frame
+
+    def get_batch(self, view_rect: tuple | list | None = None) -> tuple:
+        # (images, world top left of every image), with view_rect (x, y, width, height) only the particles that overlap it.
+        # the culling is one mask over every particle instead of a blit per particle that SDL would clip away
+        if not self.count: return [], np.zeros((0, 2), dtype=np.float64)
+
+        frame_indices = self.get_frame_indices()
+        half_sizes = self.frame_half_sizes[frame_indices]
+        positions = self.position[:self.count] - half_sizes
+        if view_rect is not None:
+            visible = np.all((positions < (view_rect[0] + view_rect[2], view_rect[1] + view_rect[3])) & (positions + half_sizes * 2 + 1 > view_rect[:2]), axis=1)
+            frame_indices = frame_indices[visible]
+            positions = positions[visible]
+
+        frames = self.frames
+        return [frames[frame_index] for frame_index in frame_indices.tolist()], positions
+
+    def get_blits(self, offset = (0, 0), view_size: tuple | None = None) -> list:
+        # (image, destination) of every particle, for Surface.blits
+        view_rect = (offset[0], offset[1], view_size[0], view_size[1]) if view_size is not None else None
+        images, positions = self.get_batch(view_rect)
+        return list(zip(images, (positions - offset).astype(np.int32).tolist()))
+
+    def queue_render(self, render_queue: Render_Queue, camera_rect: tuple | list) -> None:
+        images, positions = self.get_batch(camera_rect)
+        render_queue.add_many(images, positions, LAYER_PARTICLES)
+
+    def render(self, render_surface: pygame.Surface, offset = (0, 0)) -> None:
+        if not self.count: return
+        render_surface.blits(self.get_blits(offset, render_surface.get_size()), doreturn=False)
@@ -0,0 +1,83 @@
+import pygame
+
+class Presenter:
+    def __init__(self, screen: pygame.Surface | None, display_size: tuple | list, integer_scaling: bool = True) -> None:
+        # owns the display surface the game renders into and gets it onto the screen without allocating anything per frame.
+        # the display is stretched over the whole screen. with integer_scaling a screen that is an exact whole multiple of the
+        # display is filled by pixel doubling, which is both the fastest stretch and the sharpest one, and lets dirty rects be
+        # presented on their own
+        self.integer_scaling = integer_scaling
+        self.display_size = (int(display_size[0]), int(display_size[1]))
+        self.screen = None
+        self.display = None
+        self.target = None
+        self.scaled = None
+        self.scale_factor = None
+        self.set_screen(screen)
+
+    def set_screen(self, screen: pygame.Surface | None) -> None:
+        # call again whenever the screen surface changes, display may be a different surface afterwards
+        self.screen = screen
+        self.target = None
+        self.scaled = None
+        self.scale_factor = None
+        if screen is None:
+            if self.display is None:
+                self.display = pygame.Surface(self.display_size)
+            return
+
+        screen_size = screen.get_size()
+        if screen_size == self.display_size:
+            # nothing to scale (or SDL scales the window for us in SCALED mode), render straight into the screen
+            self.display = screen
+            return
+
+        if self.display is None or self.display is screen:
+            self.display = pygame.Surface(self.display_size).convert(screen)
+
+        width, height = self.display_size
+        scale_factor = screen_size[0] // width
+        if self.integer_scaling and scale_factor >= 1 and (width * scale_factor, height * scale_factor) == screen_size:
+            self.scale_factor = scale_factor
+
+        self.target = screen
+        # transform.scale can only write into a surface of the same pixel format, anything else goes through one reused surface
+        if self.target.get_bitsize() != self.display.get_bitsize():
+            self.scaled = pygame.Surface(screen_size, 0, self.display)
+
+    def set_display_size(self, display_size: tuple | list) -> None:
+        # a new display surface of the given size, display is a different surface afterwards
+        self.display_size = (int(display_size[0]), int(display_size[1]))
+        self.display = None
+        self.set_screen(self.screen)
+
+    def present(self, dirty_rects: list | None = None) -> None:
+        # dirty_rects are display rects, None presents the whole display and an empty list presents nothing
+        if self.screen is None: return
+
+        if dirty_rects is None:
+            if self.target is not None:
+                if self.scaled is None:
+                    pygame.transform.scale(self.display, self.target.get_size(), self.target)
+                else:
+                    pygame.transform.scale(self.display, self.scaled.get_size(), self.scaled)
+                    self.target.blit(self.scaled, (0, 0))
+            pygame.display.update()
+            return
+
+        if not dirty_rects: return
+        if self.target is None:
+            pygame.display.update(dirty_rects)
+            return
+        if self.scale_factor is None or self.scaled is not None:
+            # a stretch by an uneven factor does not map display rects to whole screen pixels, present all of it
+            self.present()
+            return
+
+        scale_factor = self.scale_factor
+        screen_rects = []
+        for rect in dirty_rects:
+            target_rect = pygame.Rect(rect.x * scale_factor, rect.y * scale_factor, rect.width * scale_factor, rect.height * scale_factor)
+            pygame.transform.scale(self.display.subsurface(rect), target_rect.size, self.target.subsurface(target_rect))
+            screen_rects.append(target_rect)
+        pygame.display.update(screen_rects)
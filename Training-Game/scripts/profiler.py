@@ -0,0 +1,107 @@
+import pygame
+import json
+import time
+from collections import deque
+
+GRAPH_COLORS = [(230, 25, 75), (60, 180, 75), (0, 130, 200), (245, 130, 48), (145, 30, 180), (70, 240, 240), (240, 50, 230), (128, 128, 0), (0, 0, 128)]
+
+class Profiler:
+    def __init__(self, enabled: bool = False, history_frames: int = 240, max_trace_events: int = 200000, frame_budget_ms: float = 1000 / 60) -> None:
+        # every method returns straight away while disabled, so the scopes can stay in the game loop of release builds
+        self.enabled = enabled
+        self.overlay_visible = False
+        self.history_frames = history_frames
+        self.frame_budget_ms = frame_budget_ms
+
+        self.start_time = time.perf_counter()
+        self.frame_start = None
+        self.scope_starts = {}
+        self.frame_scopes = {}
+        self.last_frame = {}
+
+        self.frame_history = deque(maxlen=history_frames)
+        self.scope_history = {}
+        # (name, start, duration) of the most recent scopes, kept as a ring buffer so a stutter can be exported after it happened
+        self.trace_events = deque(maxlen=max_trace_events)
+
+        self.font = None
+
+    def set_enabled(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.frame_start = None
+        self.scope_starts.clear()
+        self.frame_scopes.clear()
+
+    def toggle_overlay(self) -> None:
+        self.overlay_visible = not self.overlay_visible
+        if self.overlay_visible and not self.enabled:
+            self.set_enabled(True)
+
+    def begin(self, name: str) -> None:
+        if not self.enabled: return
+        self.scope_starts[name] = time.perf_counter()
+
+    def end(self, name: str) -> None:
+        if not self.enabled: return
+        end_time = time.perf_counter()
+        start_time = self.scope_starts.pop(name, None)
+        if start_time is None: return
+
+        duration = end_time - start_time
+        self.frame_scopes[name] = self.frame_scopes.get(name, 0.0) + duration
+        self.trace_events.append((name, start_time, duration))
+
+    def begin_frame(self) -> None:
+        if not self.enabled: return
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self) -> None:
+        if not self.enabled or self.frame_start is None: return
+        frame_time = time.perf_counter() - self.frame_start
+        self.trace_events.append(("frame", self.frame_start, frame_time))
+        self.frame_history.append(frame_time * 1000)
+
+        for name in self.frame_scopes:
+            if name not in self.scope_history:
+                self.scope_history[name] = deque([0.0] * (len(self.frame_history) - 1), maxlen=self.history_frames)
+        for name, history in self.scope_history.items():
+            history.append(self.frame_scopes.get(name, 0.0) * 1000)
+
+        self.last_frame = self.frame_scopes
+        self.frame_scopes = {}
+        self.frame_start = None
+
+    def export_chrome_trace(self, path: str) -> None:
+        # the trace event format, it can be opened in chrome://tracing or https://ui.perfetto.dev
+        events = [{"name": name, "cat": "frame" if name == "frame" else "game", "ph": "X", "pid": 1, "tid": 1,
+                   "ts": (start_time - self.start_time) * 1e6, "dur": duration * 1e6} for name, start_time, duration in self.trace_events]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def render_overlay(self, render_surface: pygame.Surface, position: tuple = (5, 5)) -> None:
+        if not self.frame_history: return
+        if self.font is None:
+            self.font = pygame.font.Font(None, 18)
+
+        graph_size = (self.history_frames, 80)
+        scale_ms = max(self.frame_budget_ms * 2, max(self.frame_history))
+        lines = [f"frame {self.frame_history[-1]:5.2f} ms  max {max(self.frame_history):5.2f} ms"]
+        lines += [f"{name} {history[-1]:5.2f} ms" for name, history in self.scope_history.items()]
+
+        panel = pygame.Surface((graph_size[0] + 10, graph_size[1] + 15 + len(lines) * 14), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 170))
+
+        budget_y = 5 + graph_size[1] - int(self.frame_budget_ms / scale_ms * graph_size[1])
+        pygame.draw.line(panel, (255, 255, 255), (5, budget_y), (5 + graph_size[0], budget_y))
+
+        graphs = [((255, 255, 255), self.frame_history)] + [(GRAPH_COLORS[i % len(GRAPH_COLORS)], history) for i, history in enumerate(self.scope_history.values())]
+        for color, history in graphs:
+            if len(history) < 2: continue
+            points = [(5 + i, 5 + graph_size[1] - min(int(value / scale_ms * graph_size[1]), graph_size[1])) for i, value in enumerate(history)]
+            pygame.draw.lines(panel, color, False, points)
+
+        for i, line in enumerate(lines):
+            color = (255, 255, 255) if i == 0 else GRAPH_COLORS[(i - 1) % len(GRAPH_COLORS)]
+            panel.blit(self.font.render(line, True, color), (5, graph_size[1] + 10 + i * 14))
+
+        render_surface.blit(panel, position)
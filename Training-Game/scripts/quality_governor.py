@@ -0,0 +1,68 @@
+from collections import deque
+
+class Quality_Governor:
+    def __init__(self, frame_budget_ms: float, number_of_levels: int, window_frames: int = 60, degrade_threshold: float = 0.9,
+                 restore_threshold: float = 0.6, cooldown_frames: int = 120) -> None:
+        # picks a quality level from the average frame time of the last window_frames frames. level 0 is full quality, every
+        # level above it is cheaper. it steps down a level when the average goes over degrade_threshold of the budget and back up
+        # when it falls under restore_threshold, the gap between the two and the cooldown after every change keep it from
+        # flipping between two levels. frame times are the time spent working on a frame, not the time waiting for the frame cap
+        self.frame_budget_ms = frame_budget_ms
+        self.number_of_levels = number_of_levels
+        self.degrade_threshold = degrade_threshold
+        self.restore_threshold = restore_threshold
+        self.cooldown_frames = cooldown_frames
+
+        self.level = 0
+        self.frame_times = deque(maxlen=window_frames)
+        self.frame_time_sum = 0.0
+        self.cooldown = 0
+        # doubled every time a level that was just restored turns out to be too slow again, so it is not retried every cooldown
+        self.restore_cooldown_frames = cooldown_frames
+        self.last_change_was_restore = False
+
+    @property
+    def average_frame_time_ms(self) -> float:
+        return self.frame_time_sum / len(self.frame_times) if self.frame_times else 0.0
+
+    def reset(self) -> None:
+        self.level = 0
+        self.frame_times.clear()
+        self.frame_time_sum = 0.0
+        self.cooldown = 0
+        self.restore_cooldown_frames = self.cooldown_frames
+        self.last_change_was_restore = False
+
+    def set_level(self, level: int, cooldown: int) -> None:
+        self.last_change_was_restore = level < self.level
+        self.level = level
+        # the frames measured at the old level say nothing about the new one
+        self.frame_times.clear()
+        self.frame_time_sum = 0.0
+        self.cooldown = cooldown
+
+    def add_frame(self, frame_time_ms: float) -> bool:
+        # returns whether the level changed
+        frame_times = self.frame_times
+        if len(frame_times) == frame_times.maxlen:
+            self.frame_time_sum -= frame_times[0]
+        frame_times.append(frame_time_ms)
+        self.frame_time_sum += frame_time_ms
+
+        if self.cooldown:
+            self.cooldown -= 1
+            return False
+        if len(frame_times) < frame_times.maxlen: return False
+
+        average_frame_time_ms = self.frame_time_sum / len(frame_times)
+        if average_frame_time_ms > self.frame_budget_ms * self.degrade_threshold and self.level < self.number_of_levels - 1:
+            if self.last_change_was_restore:
+                self.restore_cooldown_frames = min(self.restore_cooldown_frames * 2, self.cooldown_frames * 16)
+            else:
+                self.restore_cooldown_frames = self.cooldown_frames
+            self.set_level(self.level + 1, self.cooldown_frames)
+            return True
+        if average_frame_time_ms < self.frame_budget_ms * self.restore_threshold and self.level > 0:
+            self.set_level(self.level - 1, self.restore_cooldown_frames)
+            return True
+        return False
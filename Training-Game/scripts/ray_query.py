@@ -0,0 +1,258 @@
+import math
+import numpy as np
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+class Ray_Query_Engine:
+    def __init__(self, tilemap: any, chunk_shift: int) -> None:
+        self.tilemap = tilemap
+        self.chunk_shift = chunk_shift
+        self.chunk_size = 1 << chunk_shift
+
+        # sorted tile coordinates of every occupied cell per column (x -> ys) and per row (y -> xs), built on the first query
+        self.columns = None
+        self.rows = None
+
+        # (min_x, min_y, max_x, max_y) in tiles, rounded out to whole chunks
+        self.bounds = None
+        # dense occupancy of the bounds for the batched raycast, (grid, origin_x, origin_y)
+        self.occupancy_grid = None
+
+    def clear(self) -> None:
+        self.columns = None
+        self.rows = None
+        self.bounds = None
+        self.occupancy_grid = None
+
+    def build_index(self) -> None:
+        chunk_shift = self.chunk_shift
+        chunk_mask = self.chunk_size - 1
+        xs = [np.zeros(0, dtype=np.int32)]
+        ys = [np.zeros(0, dtype=np.int32)]
+        for (chunk_x, chunk_y), chunk in self.tilemap.chunks.items():
+            indices = np.flatnonzero(np.frombuffer(chunk.types, dtype=np.uint16)).astype(np.int32)
+            xs.append((chunk_x << chunk_shift) | (indices & chunk_mask))
+            ys.append((chunk_y << chunk_shift) | (indices >> chunk_shift))
+        xs = np.concatenate(xs)
+        ys = np.concatenate(ys)
+
+        self.columns = self.group_sorted(xs, ys)
+        self.rows = self.group_sorted(ys, xs)
+
+    def group_sorted(self, keys: np.ndarray, values: np.ndarray) -> dict:
+        # {key: array of its values in ascending order}
+        order = np.lexsort((values, keys))
+        keys = keys[order]
+        values = values[order].astype(np.int32)
+        unique_keys, starts = np.unique(keys, return_index=True)
+        ends = np.append(starts[1:], len(keys))
+        return {key: array("i", values[start:end].tobytes()) for key, start, end in zip(unique_keys.tolist(), starts.tolist(), ends.tolist())}
+
+    def add_tile(self, x: int, y: int) -> None:
+        # only called for cells that were empty, changing the type of an occupied cell does not affect any ray
+        if self.columns is not None:
+            insort(self.columns.setdefault(x, array("i")), y)
+            insort(self.rows.setdefault(y, array("i")), x)
+        self.bounds = None
+        self.occupancy_grid = None
+
+    def remove_tile(self, x: int, y: int) -> None:
+        if self.columns is not None:
+            for line, key, value in ((self.columns, x, y), (self.rows, y, x)):
+                values = line[key]
+                del values[bisect_left(values, value)]
+                if not values:
+                    del line[key]
+        self.bounds = None
+        self.occupancy_grid = None
+
+    def get_chunk_tiles(self, chunk_position: tuple, chunk: any) -> tuple:
+        # tile xs and ys of the occupied cells of a chunk
+        indices = np.flatnonzero(np.frombuffer(chunk.types, dtype=np.uint16))
+        return (((chunk_position[0] << self.chunk_shift) | (indices & (self.chunk_size - 1))).tolist(),
+                ((chunk_position[1] << self.chunk_shift) | (indices >> self.chunk_shift)).tolist())
+
+    def add_chunk(self, chunk_position: tuple, chunk: any) -> None:
+        # a chunk that was not in the tilemap before, e.g. streamed in
+        if self.columns is not None:
+            for x, y in zip(*self.get_chunk_tiles(chunk_position, chunk)):
+                insort(self.columns.setdefault(x, array("i")), y)
+                insort(self.rows.setdefault(y, array("i")), x)
+        self.bounds = None
+        self.occupancy_grid = None
+
+    def remove_chunk(self, chunk_position: tuple, chunk: any) -> None:
+        if self.columns is not None:
+            for x, y in zip(*self.get_chunk_tiles(chunk_position, chunk)):
+                for line, key, value in ((self.columns, x, y), (self.rows, y, x)):
+                    values = line[key]
+                    del values[bisect_left(values, value)]
+                    if not values:
+                        del line[key]
+        self.bounds = None
+        self.occupancy_grid = None
+
+    def get_bounds(self) -> tuple | None:
+        if self.bounds is None and self.tilemap.chunks:
+            chunk_xs = [chunk_position[0] for chunk_position in self.tilemap.chunks]
+            chunk_ys = [chunk_position[1] for chunk_position in self.tilemap.chunks]
+            self.bounds = (min(chunk_xs) << self.chunk_shift, min(chunk_ys) << self.chunk_shift,
+                           ((max(chunk_xs) + 1) << self.chunk_shift) - 1, ((max(chunk_ys) + 1) << self.chunk_shift) - 1)
+        return self.bounds
+
+    def get_occupancy_grid(self) -> tuple:
+        if self.occupancy_grid is None:
+            bounds = self.get_bounds()
+            if bounds is None:
+                self.occupancy_grid = (np.zeros((0, 0), dtype=bool), 0, 0)
+                return self.occupancy_grid
+
+            chunk_size = self.chunk_size
+            grid = np.zeros((bounds[3] - bounds[1] + 1, bounds[2] - bounds[0] + 1), dtype=bool)
+            for (chunk_x, chunk_y), chunk in self.tilemap.chunks.items():
+                grid_x = (chunk_x << self.chunk_shift) - bounds[0]
+                grid_y = (chunk_y << self.chunk_shift) - bounds[1]
+                grid[grid_y:grid_y + chunk_size, grid_x:grid_x + chunk_size] = np.frombuffer(chunk.types, dtype=np.uint16).reshape(chunk_size, chunk_size) != 0
+            self.occupancy_grid = (grid, bounds[0], bounds[1])
+        return self.occupancy_grid
+
+    def get_tile_position_in_direction(self, tile_position: tuple, direction: tuple, max_tile_range: int | None = None) -> tuple | None:
+        # the first occupied tile after tile_position, stepping by direction one tile at a time
+        x, y = tile_position
+        dx, dy = direction
+        if self.columns is None:
+            self.build_index()
+
+        if dx == 0 and dy in (1, -1):
+            line, start = self.columns.get(x), y
+        elif dy == 0 and dx in (1, -1):
+            line, start = self.rows.get(y), x
+        else:
+            return self.step_in_direction(tile_position, direction, max_tile_range)
+
+        if not line: return None
+        step = dx + dy
+        if step > 0:
+            index = bisect_right(line, start)
+            if index == len(line): return None
+        else:
+            index = bisect_left(line, start) - 1
+            if index < 0: return None
+
+        distance = abs(line[index] - start)
+        if max_tile_range is not None and distance > max_tile_range: return None
+        return (x, line[index]) if dx == 0 else (line[index], y)
+
+    def step_in_direction(self, tile_position: tuple, direction: tuple, max_tile_range: int | None) -> tuple | None:
+        x, y = tile_position
+        dx, dy = direction
+        if dx == 0 and dy == 0: return None
+
+        bounds = self.get_bounds()
+        if bounds is None: return None
+        # without a range limit walk until the ray has left the bounds for good
+        if max_tile_range is None:
+            max_tile_range = max(bounds[2] - bounds[0], bounds[3] - bounds[1]) + max(abs(x - bounds[0]), abs(x - bounds[2]), abs(y - bounds[1]), abs(y - bounds[3])) + 1
+
+        get_type_id_at = self.tilemap.get_type_id_at
+        for _ in range(max_tile_range):
+            x += dx
+            y += dy
+            if get_type_id_at(x, y):
+                return (x, y)
+        return None
+
+    def raycast(self, origin: tuple | list, direction: tuple | list, max_distance: float | None = None) -> tuple | None:
+        # grid DDA in pixels, returns ((tile_x, tile_y), distance travelled to the hit) for the first occupied tile after the starting one
+        bounds = self.get_bounds()
+        if bounds is None: return None
+
+        tile_size = self.tilemap.tile_size
+        length = math.hypot(direction[0], direction[1])
+        if not length: return None
+        dx, dy = direction[0] / length, direction[1] / length
+        if max_distance is None:
+            max_distance = math.inf
+
+        x, y = int(origin[0] // tile_size), int(origin[1] // tile_size)
+        step_x = 1 if dx > 0 else -1 if dx < 0 else 0
+        step_y = 1 if dy > 0 else -1 if dy < 0 else 0
+        t_delta_x = tile_size / abs(dx) if dx else math.inf
+        t_delta_y = tile_size / abs(dy) if dy else math.inf
+        t_max_x = (((x + 1) * tile_size - origin[0]) if step_x > 0 else (origin[0] - x * tile_size)) / abs(dx) if dx else math.inf
+        t_max_y = (((y + 1) * tile_size - origin[1]) if step_y > 0 else (origin[1] - y * tile_size)) / abs(dy) if dy else math.inf
+
+        min_x, min_y, max_x, max_y = bounds
+        get_type_id_at = self.tilemap.get_type_id_at
+        while True:
+            if t_max_x < t_max_y:
+                x += step_x
+                distance = t_max_x
+                t_max_x += t_delta_x
+            else:
+                y += step_y
+                distance = t_max_y
+                t_max_y += t_delta_y
+
+            if distance > max_distance: return None
+            if (x < min_x and step_x <= 0) or (x > max_x and step_x >= 0) or (y < min_y and step_y <= 0) or (y > max_y and step_y >= 0): return None
+            if get_type_id_at(x, y):
+                return (x, y), distance
+
+    def raycast_many(self, origins: np.ndarray, directions: np.ndarray, max_distance: float | None = None) -> tuple:
+        # the same DDA as raycast, stepping every ray at once against a dense occupancy grid.
+        # returns (hit, tile_positions, distances), tile_positions and distances are only meaningful where hit is True
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 2)
+        number_of_rays = len(origins)
+        hit = np.zeros(number_of_rays, dtype=bool)
+        tile_positions = np.zeros((number_of_rays, 2), dtype=np.int64)
+        distances = np.full(number_of_rays, np.inf)
+
+        grid, grid_x, grid_y = self.get_occupancy_grid()
+        if not grid.size: return hit, tile_positions, distances
+        grid_height, grid_width = grid.shape
+        if max_distance is None:
+            max_distance = np.inf
+
+        tile_size = self.tilemap.tile_size
+        lengths = np.hypot(directions[:, 0], directions[:, 1])
+        lengths[lengths == 0] = 1
+        directions = directions / lengths[:, None]
+
+        cells = np.floor_divide(origins, tile_size).astype(np.int64)
+        steps = np.sign(directions).astype(np.int64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse = np.where(directions != 0, 1 / np.abs(directions), np.inf)
+            boundary = np.where(steps > 0, (cells + 1) * tile_size - origins, origins - cells * tile_size)
+            t_max = np.where(steps != 0, boundary * inverse, np.inf)
+            t_delta = np.where(steps != 0, tile_size * inverse, np.inf)
+
+        active = np.flatnonzero(steps.any(axis=1))
+        while active.size:
+            current_t_max = t_max[active]
+            # step along x when it reaches its next boundary first, y on ties, the same as raycast
+            axis = (current_t_max[:, 0] >= current_t_max[:, 1]).astype(np.int64)
+            distance = current_t_max[np.arange(active.size), axis]
+            cells[active, axis] += steps[active, axis]
+            t_max[active, axis] += t_delta[active, axis]
+
+            local_x = cells[active, 0] - grid_x
+            local_y = cells[active, 1] - grid_y
+            inside = (local_x >= 0) & (local_x < grid_width) & (local_y >= 0) & (local_y < grid_height)
+            occupied = np.zeros(active.size, dtype=bool)
+            occupied[inside] = grid[local_y[inside], local_x[inside]]
+
+            beyond = distance > max_distance
+            new_hits = occupied & ~beyond
+            hit_rays = active[new_hits]
+            hit[hit_rays] = True
+            tile_positions[hit_rays] = cells[hit_rays]
+            distances[hit_rays] = distance[new_hits]
+
+            ray_steps = steps[active]
+            leaving = (((local_x < 0) & (ray_steps[:, 0] <= 0)) | ((local_x >= grid_width) & (ray_steps[:, 0] >= 0)) |
+                       ((local_y < 0) & (ray_steps[:, 1] <= 0)) | ((local_y >= grid_height) & (ray_steps[:, 1] >= 0)))
+            active = active[~(new_hits | beyond | leaving)]
+
+        return hit, tile_positions, distances
@@ -0,0 +1,84 @@
+import pygame
+import weakref
+import numpy as np
+
+# draw order, lower layers are drawn first
+LAYER_TILES = 0
+LAYER_ENTITIES = 10
+LAYER_MARKERS = 20
+LAYER_PARTICLES = 30
+
+class Render_Queue:
+    def __init__(self) -> None:
+        # the draw commands of a frame, collected from every system in world coordinates. they are turned into screen
+        # coordinates in one go and drawn layer by layer through a single Surface.blits call (fblits where pygame-ce has it)
+        # layer -> batches of (surfaces, world positions), drawn in the order they were added
+        self.layers = {}
+        self.command_count = 0
+        self.use_fblits = hasattr(pygame.Surface, "fblits")
+        # display pixels per world pixel. below 1 the same part of the world is drawn scaled down, from copies of the surfaces that
+        # are scaled the first time they are drawn and dropped together with the surface they were made from
+        self.scale = 1.0
+        self.scaled_surfaces = weakref.WeakKeyDictionary()
+
+    def __len__(self) -> int:
+        return self.command_count
+
+    def clear(self) -> None:
+        self.layers.clear()
+        self.command_count = 0
+
+    def set_scale(self, scale: float) -> None:
+        if scale == self.scale: return
+        self.scale = scale
+        self.scaled_surfaces = weakref.WeakKeyDictionary()
+
+    def get_scaled_surface(self, surface: pygame.Surface) -> pygame.Surface:
+        scaled_surface = self.scaled_surfaces.get(surface)
+        if scaled_surface is None:
+            scaled_surface = pygame.transform.scale_by(surface, self.scale)
+            self.scaled_surfaces[surface] = scaled_surface
+        return scaled_surface
+
+    def add(self, surface: pygame.Surface, position: tuple | list, layer: int = LAYER_ENTITIES) -> None:
+        batches = self.layers.setdefault(layer, [])
+        # single commands are gathered into a batch of plain lists, a numpy batch added in between starts a new one
+        if not batches or not isinstance(batches[-1][1], list):
+            batches.append(([], []))
+        surfaces, positions = batches[-1]
+        surfaces.append(surface)
+        positions.append(position)
+        self.command_count += 1
+
+    def add_many(self, surfaces: list, positions: np.ndarray | list, layer: int = LAYER_ENTITIES) -> None:
+        # positions is one (x, y) per surface, the list and the array are taken over, not copied
+        if not len(surfaces): return
+        if isinstance(positions, list):
+            positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.layers.setdefault(layer, []).append((surfaces, positions))
+        self.command_count += len(surfaces)
+
+    def get_blits(self, offset: tuple | list = (0, 0), layers: tuple | list | None = None) -> list:
+        # (surface, screen position) in draw order for Surface.blits, of every layer or only of the given ones.
+        # screen positions are truncated towards zero like blit does with a float position
+        scale = self.scale
+        blits = []
+        for layer in sorted(self.layers):
+            if layers is not None and layer not in layers: continue
+            for surfaces, positions in self.layers[layer]:
+                destinations = np.asarray(positions, dtype=np.float64).reshape(-1, 2) - offset
+                if scale != 1:
+                    destinations *= scale
+                    surfaces = [self.get_scaled_surface(surface) for surface in surfaces]
+                blits += zip(surfaces, destinations.astype(np.int32).tolist())
+        return blits
+
+    def draw(self, target: pygame.Surface, blits: list) -> None:
+        if not blits: return
+        if self.use_fblits:
+            target.fblits(blits)
+        else:
+            target.blits(blits, doreturn=False)
+
+    def submit(self, target: pygame.Surface, offset: tuple | list = (0, 0)) -> None:
+        self.draw(target, self.get_blits(offset))
@@ -0,0 +1,85 @@
+import struct
+
+# a replay file, all little endian:
+#   header: magic, version, random seed, simulation rate, number of ticks, whether the level was streamed, level path length,
+#           then the level path as utf-8
+#   inputs: runs of (input bits, number of ticks) covering every simulation tick in order
+#   footer: digest of the entity state after the last tick, replaying has to end on the same one
+REPLAY_MAGIC = b"GBRP"
+REPLAY_VERSION = 2
+HEADER = struct.Struct("<4sHqHI?H")
+INPUT_RUN = struct.Struct("<BH")
+DIGEST_SIZE = 20
+MAX_RUN_LENGTH = 0xFFFF
+
+# input bits of one tick
+INPUT_LEFT = 1
+INPUT_RIGHT = 2
+INPUT_SWITCH_GROUND = 4
+
+def encode_input(movement: tuple | list, switch_ground: bool) -> int:
+    return (INPUT_LEFT if movement[0] else 0) | (INPUT_RIGHT if movement[1] else 0) | (INPUT_SWITCH_GROUND if switch_ground else 0)
+
+def decode_input(input_bits: int) -> tuple:
+    # ([left, right], switch_ground)
+    return [bool(input_bits & INPUT_LEFT), bool(input_bits & INPUT_RIGHT)], bool(input_bits & INPUT_SWITCH_GROUND)
+
+class Replay:
+    def __init__(self, seed: int, simulation_rate: int, level_path: str | None = None, level_streaming: bool = False, inputs: bytearray | None = None, state_digest: bytes | None = None) -> None:
+        self.seed = seed
+        self.simulation_rate = simulation_rate
+        self.level_path = level_path
+        # whether the level was streamed in around the camera or loaded whole, playback has to load it the same way
+        self.level_streaming = level_streaming
+        # one byte of input bits per simulation tick
+        self.inputs = inputs if inputs is not None else bytearray()
+        self.state_digest = state_digest
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+    def record(self, input_bits: int) -> None:
+        self.inputs.append(input_bits)
+
+    def save(self, path: str, state_digest: bytes) -> None:
+        self.state_digest = state_digest
+        level_path = (self.level_path or "").encode("utf-8")
+        runs = bytearray()
+        inputs = self.inputs
+        start = 0
+        while start < len(inputs):
+            end = start + 1
+            while end < len(inputs) and inputs[end] == inputs[start] and end - start < MAX_RUN_LENGTH:
+                end += 1
+            runs += INPUT_RUN.pack(inputs[start], end - start)
+            start = end
+
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed, self.simulation_rate, len(inputs), self.level_streaming, len(level_path)))
+            file.write(level_path)
+            file.write(runs)
+            file.write(state_digest)
+
+    @classmethod
+    def load(cls, path: str) -> "Replay":
+        with open(path, "rb") as file:
+            data = file.read()
+
+        magic, version, seed, simulation_rate, number_of_ticks, level_streaming, level_path_length = HEADER.unpack_from(data, 0)
+        if magic != REPLAY_MAGIC:
+            raise ValueError(f"{path} is not a replay file")
+        if version != REPLAY_VERSION:
+            raise ValueError(f"{path} is replay format {version}, expected {REPLAY_VERSION}")
+
+        offset = HEADER.size
+        level_path = data[offset:offset + level_path_length].decode("utf-8") or None
+        offset += level_path_length
+
+        inputs = bytearray()
+        while len(inputs) < number_of_ticks:
+            input_bits, run_length = INPUT_RUN.unpack_from(data, offset)
+            offset += INPUT_RUN.size
+            inputs += bytes((input_bits,)) * run_length
+        state_digest = data[offset:offset + DIGEST_SIZE]
+
+        return cls(seed, simulation_rate, level_path, level_streaming, inputs, state_digest)
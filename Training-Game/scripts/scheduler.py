@@ -0,0 +1,79 @@
+import heapq
+from itertools import count
+from typing import Callable
+
+from utils import Game_Clock
+
+class Scheduled_Event:
+    __slots__ = ("due_time_ms", "callback", "args", "kwargs", "cancelled")
+
+    def __init__(self, due_time_ms: float, callback: Callable, args: tuple, kwargs: dict) -> None:
+        self.due_time_ms = due_time_ms
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+class Scheduler:
+    def __init__(self, clock: Game_Clock) -> None:
+        self.clock = clock
+        # heap of (due_time_ms, sequence_number, event), the sequence number keeps events that are due at the same time in the order they were scheduled
+        self.events = []
+        self.sequence = count()
+        self.number_cancelled = 0
+
+    def __len__(self) -> int:
+        return len(self.events) - self.number_cancelled
+
+    def schedule(self, delay_ms: float | int, callback: Callable, *args, **kwargs) -> Scheduled_Event:
+        event = Scheduled_Event(self.clock.time_ms + delay_ms, callback, args, kwargs)
+        heapq.heappush(self.events, (event.due_time_ms, next(self.sequence), event))
+        return event
+
+    def cancel(self, event: Scheduled_Event) -> None:
+        if event.cancelled or event.callback is None: return
+        event.cancelled = True
+        self.number_cancelled += 1
+
+        # cancelled events are only skipped when they are popped, so rebuild the heap if they start to make up most of it
+        if self.number_cancelled > 64 and self.number_cancelled > len(self.events) // 2:
+            # in place, update may be holding on to the list while a callback cancels events
+            self.events[:] = [entry for entry in self.events if not entry[2].cancelled]
+            heapq.heapify(self.events)
+            self.number_cancelled = 0
+
+    def clear(self) -> None:
+        # dropped events lose their callback like fired ones, so cancelling them afterwards does not touch the count
+        for _, _, event in self.events:
+            event.callback = None
+        self.events.clear()
+        self.number_cancelled = 0
+
+    def save_events(self) -> list:
+        # copies of the events still to fire, in the order they fire, for restore_events. a fired event drops its callback, the
+        # copies keep theirs
+        return [Scheduled_Event(event.due_time_ms, event.callback, event.args, event.kwargs)
+                for _, _, event in sorted(self.events, key=lambda entry: entry[:2]) if not event.cancelled]
+
+    def restore_events(self, events: list) -> None:
+        # replaces everything scheduled with copies of events, so the same list can be restored again after they have fired.
+        # events due at the same time fire in the order given, and events scheduled afterwards still fire after them. the events
+        # schedule returned before are not queued anymore and cancelling them does nothing
+        events = [Scheduled_Event(event.due_time_ms, event.callback, event.args, event.kwargs) for event in events if not event.cancelled]
+        self.clear()
+        for event in events:
+            heapq.heappush(self.events, (event.due_time_ms, next(self.sequence), event))
+
+    def update(self) -> None:
+        time_ms = self.clock.time_ms
+        events = self.events
+        while events and events[0][0] <= time_ms:
+            event = heapq.heappop(events)[2]
+            if event.cancelled:
+                self.number_cancelled -= 1
+                continue
+
+            callback = event.callback
+            # a fired event drops its callback so cancelling it afterwards does nothing
+            event.callback = None
+            callback(*event.args, **event.kwargs)
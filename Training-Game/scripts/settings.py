@@ -7,15 +7,76 @@ class Settings:
         self.display_scaling_factor = 0.5
         self.display_size = (self.screen_size[0] * self.display_scaling_factor, self.screen_size[1] * self.display_scaling_factor)
 
+        # let SDL scale the display_size window up to the desktop (pygame.SCALED) instead of scaling it ourselves every frame
+        self.hardware_scaling = False
+        # scale by the largest whole factor that fits the screen and centre the result, instead of stretching to fill the screen
+        self.integer_scaling = True
+        # only redraw and present the parts of the display that changed while the camera stands still, a full redraw otherwise
+        self.dirty_rect_rendering = False
+
         self.target_fps = 60
 
+        # lowers the quality level when frames take longer than the frame budget and raises it again once there is headroom
+        self.adaptive_quality = True
+        # level 0 is full quality. particle_scale is the share of particles spawned and display_scale scales display_size, keep it
+        # at 1 / whole number so integer scaling still fills the screen. a smaller display shows the same part of the level, drawn smaller.
+        # display_scale only applies with hardware_scaling, stretching a smaller display in software costs more than it saves
+        self.quality_levels = [
+            {"particle_scale": 1.0, "display_scale": 1.0},
+            {"particle_scale": 0.5, "display_scale": 1.0},
+            {"particle_scale": 0.25, "display_scale": 0.5}
+        ]
+        # frames averaged, share of the frame budget that steps a level down or back up, and frames to wait after a change
+        self.quality_window_frames = 60
+        self.quality_degrade_threshold = 0.9
+        self.quality_restore_threshold = 0.6
+        self.quality_cooldown_frames = 120
+        # the physics always steps at this rate, independent of the frame rate
+        self.simulation_rate = 60
+        # longest frame the simulation will try to catch up on, so a stall does not turn into hundreds of steps
+        self.max_frame_time = 0.25
+
+        # timing scopes around each stage of the frame, F3 shows the overlay (and turns the profiler on), F4 exports a chrome trace
+        self.profiler_enabled = False
+        self.profiler_history_frames = 240
+
+        # seeds Game.random, which all gameplay randomness comes from. None picks a new seed every run
+        self.random_seed = None
+        # every tick of input is recorded while playing, F5 saves it as replay_<time>.gbreplay and it is saved here on quit if set
+        self.replay_record_path = None
+
         self.asset_paths = {
             "graphics": "../assets/graphics/",
             "entities": "../assets/graphics/entities/",
-            "particles": "../assets/graphics/particles/"
+            "particles": "../assets/graphics/particles/",
+            "cache": "../assets/cache/"
         }
+        # threads used to decode the texture atlases at startup, None lets the thread pool pick
+        self.asset_loader_threads = None
 
         self.tile_size = 32
+        # memory limit for the pre-rendered tile chunk surfaces and their copies at a lower display_scale, least recently used chunks are
+        # dropped past it
+        self.tile_render_cache_bytes = 32 * 1024 * 1024
+
+        # a level converted with level_loader.py, None loads the built in test level. chunks are streamed in around the camera
+        self.level_path = None
+        # the tile type level_loader.py turns the tiles of each Tiled tileset into, a map using a tileset missing here does not convert
+        self.tileset_types = {"grass": "grass"}
+        # in chunks around the ones on screen, chunks are loaded inside the load radius and dropped outside the unload radius
+        self.level_load_radius = 1
+        self.level_unload_radius = 3
+        # extra chunks loaded ahead in the direction the camera is moving
+        self.level_prefetch_chunks = 2
+        # stream the level in around the camera instead of loading all of it up front. None streams when there is a window.
+        # replays are played back the way they were recorded, the tiles the simulation sees depend on it
+        self.level_streaming = None
+
+        # cell size in pixels of the spatial hash entities are kept in, rendering only looks at the cells the camera overlaps
+        self.spatial_hash_cell_size = 256
+        # entities off screen and further than this many pixels from the centre of the camera are not stepped until they are back
+        # in range. None steps every entity every tick
+        self.simulation_active_radius = None
 
         self.entities = {
             "player": {"size": (11*2, 14*2), "speed": 300, "switch_ground_time": 100}
@@ -0,0 +1,135 @@
+import struct
+import numpy as np
+from array import array
+
+from entity_store import ROW_ARRAYS
+from particle import PARTICLE_ARRAYS
+from scheduler import Scheduled_Event
+
+# a snapshot of everything a Game simulates, in native byte order. it is meant for branching and retrying runs in the same
+# build on the same machine, not for saving to disk. the tilemap is not in it, the game it is restored into shares the tilemap
+# and has to have the same tilemap revision and the same entities as the game it was taken from
+#   header: magic, version, tilemap revision, entities, particles, particle types, scheduled spawns, debug markers (-1 for none)
+#   game: clock time and dt, accumulator, ticks, camera, previous camera, input, particle spawn credit
+#   random: gauss_next (nan for none), then the Mersenne Twister state
+#   entities: every Entity_Store array, the clip each entity plays included
+#   particles: (name length, name) of every particle type in type id order, then every Particle_System array
+#   scheduled spawns: (due time, particle type id, position, velocity) in the order they are due
+#   markers: (x, y) per debug marker
+SNAPSHOT_MAGIC = b"GBSS"
+SNAPSHOT_VERSION = 4
+HEADER = struct.Struct("=4sHQIIIIi")
+GAME_STATE = struct.Struct("=dddQdddd???d")
+RANDOM_STATE_SIZE = 625
+SCHEDULED_SPAWN = struct.Struct("=dIdddd")
+MARKER = struct.Struct("=dd")
+
+def take_snapshot(game: any) -> bytes:
+    store = game.entity_store
+    particles = game.particles
+    clock = game.game_clock
+
+    spawn = particles.spawn
+    scheduled_spawns = []
+    for event in game.scheduler.save_events():
+        if event.callback != spawn or event.kwargs:
+            raise ValueError(f"scheduled event {event.callback} can not be snapshot, only delayed particle spawns can")
+        particle_type, position, velocity = event.args
+        scheduled_spawns.append(SCHEDULED_SPAWN.pack(event.due_time_ms, particles.get_type_id(particle_type), position[0], position[1], velocity[0], velocity[1]))
+
+    markers = game.particle_positions
+    particle_types = list(particles.particle_type_ids)
+    parts = [HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, game.tilemap.revision, store.count, particles.count, len(particle_types), len(scheduled_spawns),
+                         -1 if markers is None else len(markers)),
+             GAME_STATE.pack(clock.time_ms, clock.dt, game.accumulator, game.ticks, *game.world_offset, *game.previous_world_offset,
+                             *game.player_movement, game.switch_ground_requested, game.particle_spawn_credit)]
+
+    _, mersenne_twister_state, gauss_next = game.random.getstate()
+    parts.append(struct.pack("=d", np.nan if gauss_next is None else gauss_next))
+    parts.append(array("I", mersenne_twister_state).tobytes())
+
+    for name in ROW_ARRAYS:
+        parts.append(getattr(store, name)[:store.count].tobytes())
+
+    for particle_type in particle_types:
+        particle_type = particle_type.encode("utf-8")
+        parts.append(struct.pack("=B", len(particle_type)))
+        parts.append(particle_type)
+    for name in PARTICLE_ARRAYS:
+        parts.append(getattr(particles, name)[:particles.count].tobytes())
+    parts += scheduled_spawns
+    if markers:
+        parts += [MARKER.pack(position[0], position[1]) for position in markers]
+    return b"".join(parts)
+
+def read_rows(data: memoryview, offset: int, target: np.ndarray, rows: int) -> int:
+    # copies the first rows of target straight out of data, returns the offset after them
+    size = rows * target.strides[0]
+    memoryview(target).cast("B")[:size] = data[offset:offset + size]
+    return offset + size
+
+def restore_snapshot(game: any, snapshot: bytes) -> None:
+    data = memoryview(snapshot)
+    magic, version, tilemap_revision, entity_count, particle_count, particle_type_count, scheduled_spawn_count, marker_count = HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("not a game snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"snapshot format {version}, expected {SNAPSHOT_VERSION}")
+    if tilemap_revision != game.tilemap.revision:
+        raise ValueError(f"the snapshot was taken at tilemap revision {tilemap_revision}, the tilemap is at {game.tilemap.revision}")
+    store = game.entity_store
+    if entity_count != store.count:
+        raise ValueError(f"the snapshot has {entity_count} entities, the game has {store.count}")
+    offset = HEADER.size
+
+    clock = game.game_clock
+    (clock.time_ms, clock.dt, game.accumulator, game.ticks, world_offset_x, world_offset_y, previous_world_offset_x, previous_world_offset_y,
+     move_left, move_right, game.switch_ground_requested, game.particle_spawn_credit) = GAME_STATE.unpack_from(data, offset)
+    game.world_offset = [world_offset_x, world_offset_y]
+    game.previous_world_offset = [previous_world_offset_x, previous_world_offset_y]
+    game.player_movement = [move_left, move_right]
+    offset += GAME_STATE.size
+    # the input recorded since the snapshot was taken belongs to ticks that are undone, the recording carries on from here
+    if game.recording is not None:
+        del game.recording.inputs[game.ticks:]
+
+    gauss_next = struct.unpack_from("=d", data, offset)[0]
+    offset += 8
+    mersenne_twister_state = array("I")
+    mersenne_twister_state.frombytes(data[offset:offset + RANDOM_STATE_SIZE * 4])
+    offset += RANDOM_STATE_SIZE * 4
+    game.random.setstate((3, tuple(mersenne_twister_state), None if gauss_next != gauss_next else gauss_next))
+
+    for name in ROW_ARRAYS:
+        offset = read_rows(data, offset, getattr(store, name), entity_count)
+    game.spatial_hash.move_many(store.entities, np.hstack((store.position[:entity_count], store.size[:entity_count])))
+
+    # particle type ids are handed out as types are first spawned, so they are mapped onto this game's ids by name
+    particles = game.particles
+    particle_types = []
+    for _ in range(particle_type_count):
+        name_length = data[offset]
+        particle_types.append(bytes(data[offset + 1:offset + 1 + name_length]).decode("utf-8"))
+        offset += 1 + name_length
+    type_ids = np.array([particles.get_type_id(particle_type) for particle_type in particle_types], dtype=np.int32)
+
+    particles.reserve(particle_count)
+    for name in PARTICLE_ARRAYS:
+        offset = read_rows(data, offset, getattr(particles, name), particle_count)
+    if particle_count:
+        particles.type_id[:particle_count] = type_ids[particles.type_id[:particle_count]]
+    particles.count = particle_count
+
+    # the spawns were stored in the order they fire
+    spawn = particles.spawn
+    scheduled_spawns = []
+    for _ in range(scheduled_spawn_count):
+        due_time_ms, type_id, x, y, velocity_x, velocity_y = SCHEDULED_SPAWN.unpack_from(data, offset)
+        offset += SCHEDULED_SPAWN.size
+        scheduled_spawns.append(Scheduled_Event(due_time_ms, spawn, (particle_types[type_id], (x, y), (velocity_x, velocity_y)), {}))
+    game.scheduler.restore_events(scheduled_spawns)
+
+    if marker_count < 0:
+        game.particle_positions = None
+    else:
+        game.particle_positions = [MARKER.unpack_from(data, offset + i * MARKER.size) for i in range(marker_count)]
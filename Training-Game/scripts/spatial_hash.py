@@ -0,0 +1,85 @@
+import math
+import numpy as np
+
+class Spatial_Hash:
+    def __init__(self, cell_size: int) -> None:
+        # a uniform grid of cell_size pixel cells, an item is in every cell its rect overlaps. items are moved whenever they move,
+        # which only touches the cells when the item crosses into a different cell
+        self.cell_size = cell_size
+        # (cell x, cell y) -> the items in that cell, a dict so the cells keep the order the items were added in
+        self.cells = {}
+        # item -> (start x, start y, end x, end y) of the cells it is in, end inclusive
+        self.item_cells = {}
+
+    def __len__(self) -> int:
+        return len(self.item_cells)
+
+    def __contains__(self, item: any) -> bool:
+        return item in self.item_cells
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self.item_cells.clear()
+
+    def get_cell_range(self, x: float, y: float, width: float, height: float) -> tuple:
+        cell_size = self.cell_size
+        return (math.floor(x / cell_size), math.floor(y / cell_size), math.floor((x + width) / cell_size), math.floor((y + height) / cell_size))
+
+    def add_to_cells(self, item: any, cell_range: tuple) -> None:
+        cells = self.cells
+        for cell_x in range(cell_range[0], cell_range[2] + 1):
+            for cell_y in range(cell_range[1], cell_range[3] + 1):
+                cell = cells.get((cell_x, cell_y))
+                if cell is None:
+                    cell = cells[(cell_x, cell_y)] = {}
+                cell[item] = None
+        self.item_cells[item] = cell_range
+
+    def remove_from_cells(self, item: any, cell_range: tuple) -> None:
+        cells = self.cells
+        for cell_x in range(cell_range[0], cell_range[2] + 1):
+            for cell_y in range(cell_range[1], cell_range[3] + 1):
+                cell = cells[(cell_x, cell_y)]
+                del cell[item]
+                if not cell:
+                    del cells[(cell_x, cell_y)]
+
+    def move(self, item: any, x: float, y: float, width: float, height: float) -> None:
+        # adds the item if it is not in the hash yet
+        cell_range = self.get_cell_range(x, y, width, height)
+        old_cell_range = self.item_cells.get(item)
+        if old_cell_range == cell_range: return
+        if old_cell_range is not None:
+            self.remove_from_cells(item, old_cell_range)
+        self.add_to_cells(item, cell_range)
+
+    def move_many(self, items: list, rects: np.ndarray) -> None:
+        # rects is (x, y, width, height) per item, the cells are worked out for all of them at once
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        starts = np.floor(rects[:, :2] / self.cell_size)
+        ends = np.floor((rects[:, :2] + rects[:, 2:]) / self.cell_size)
+        item_cells = self.item_cells
+        for item, cell_range in zip(items, np.hstack((starts, ends)).astype(np.int64).tolist()):
+            cell_range = tuple(cell_range)
+            old_cell_range = item_cells.get(item)
+            if old_cell_range == cell_range: continue
+            if old_cell_range is not None:
+                self.remove_from_cells(item, old_cell_range)
+            self.add_to_cells(item, cell_range)
+
+    def remove(self, item: any) -> None:
+        cell_range = self.item_cells.pop(item, None)
+        if cell_range is not None:
+            self.remove_from_cells(item, cell_range)
+
+    def query(self, x: float, y: float, width: float, height: float) -> list:
+        # every item in a cell the rect overlaps, each once. items near the rect but not inside it can be returned as well
+        start_x, start_y, end_x, end_y = self.get_cell_range(x, y, width, height)
+        cells = self.cells
+        items = {}
+        for cell_x in range(start_x, end_x + 1):
+            for cell_y in range(start_y, end_y + 1):
+                cell = cells.get((cell_x, cell_y))
+                if cell:
+                    items.update(cell)
+        return list(items)
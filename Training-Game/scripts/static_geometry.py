@@ -0,0 +1,97 @@
+import pygame
+from typing import List
+
+class Static_Geometry:
+    def __init__(self, tilemap: any, chunk_shift: int) -> None:
+        # physics tiles merged into as few rects as possible, one list per tilemap chunk. a merged rect never crosses a chunk border,
+        # so the chunk grid doubles as the spatial index and editing a tile only has to recompile the chunk it is in
+        self.tilemap = tilemap
+        self.chunk_shift = chunk_shift
+        self.chunk_size = 1 << chunk_shift
+        self.chunk_rects = {}
+
+        self.query_area = pygame.Rect(0, 0, 0, 0)
+
+    @property
+    def rect_count(self) -> int:
+        return sum(len(rects) for rects in self.chunk_rects.values())
+
+    def invalidate(self, chunk_position: tuple) -> None:
+        self.chunk_rects.pop(chunk_position, None)
+
+    def clear(self) -> None:
+        self.chunk_rects.clear()
+
+    def compile(self) -> None:
+        for chunk_position in self.tilemap.chunks:
+            if chunk_position not in self.chunk_rects:
+                self.compile_chunk(chunk_position)
+
+    def compile_chunk(self, chunk_position: tuple) -> List[pygame.Rect]:
+        chunk = self.tilemap.chunks.get(chunk_position)
+        if chunk is None:
+            self.chunk_rects[chunk_position] = []
+            return self.chunk_rects[chunk_position]
+
+        chunk_shift = self.chunk_shift
+        chunk_size = self.chunk_size
+        tile_size = self.tilemap.tile_size
+        physics_type_ids = self.tilemap.physics_type_ids
+        # solid cells that are not part of a rect yet
+        open_cells = bytearray(physics_type_ids[type_id] for type_id in chunk.types)
+
+        # greedy meshing: take the first open cell, grow it as far right as possible, then grow that whole span down
+        rects = []
+        origin_x = chunk_position[0] << chunk_shift
+        origin_y = chunk_position[1] << chunk_shift
+        for y in range(chunk_size):
+            row = y << chunk_shift
+            x = 0
+            while x < chunk_size:
+                if not open_cells[row | x]:
+                    x += 1
+                    continue
+
+                width = 1
+                while x + width < chunk_size and open_cells[row | (x + width)]:
+                    width += 1
+
+                height = 1
+                while y + height < chunk_size:
+                    next_row = (y + height) << chunk_shift
+                    if open_cells[next_row | x:(next_row | x) + width].count(0): break
+                    height += 1
+
+                for covered_y in range(y, y + height):
+                    covered_row = covered_y << chunk_shift
+                    open_cells[covered_row | x:(covered_row | x) + width] = bytes(width)
+
+                rects.append(pygame.Rect((origin_x + x) * tile_size, (origin_y + y) * tile_size, width * tile_size, height * tile_size))
+                x += width
+
+        self.chunk_rects[chunk_position] = rects
+        return rects
+
+    def query(self, area: pygame.Rect, rects: list) -> list:
+        # appends every merged rect that overlaps area, the rects are shared and must not be modified
+        chunk_pixel_size = self.chunk_size * self.tilemap.tile_size
+        chunks = self.tilemap.chunks
+        chunk_rects = self.chunk_rects
+        for chunk_x in range(area.left // chunk_pixel_size, (area.right - 1) // chunk_pixel_size + 1):
+            for chunk_y in range(area.top // chunk_pixel_size, (area.bottom - 1) // chunk_pixel_size + 1):
+                chunk_position = (chunk_x, chunk_y)
+                if chunk_position not in chunks: continue
+
+                candidates = chunk_rects.get(chunk_position)
+                if candidates is None:
+                    candidates = self.compile_chunk(chunk_position)
+                for index in area.collidelistall(candidates):
+                    rects.append(candidates[index])
+        return rects
+
+    def query_around(self, position: tuple | list, rects: list) -> list:
+        # the merged rects overlapping the 3x3 tiles around position
+        tile_size = self.tilemap.tile_size
+        area = self.query_area
+        area.update((int(position[0] // tile_size) - 1) * tile_size, (int(position[1] // tile_size) - 1) * tile_size, tile_size * 3, tile_size * 3)
+        return self.query(area, rects)
\ No newline at end of file
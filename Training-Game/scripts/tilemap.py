@@ -1,57 +1,346 @@
 import pygame
-from typing import List
+from array import array
+from collections import OrderedDict
+from typing import List, Iterator
+
+from collision import Collision_World
+from static_geometry import Static_Geometry
+from ray_query import Ray_Query_Engine
+from render_queue import Render_Queue, LAYER_TILES
 
 NEIGHBOURING_TILES = {(-1, 1), (-1, 0), (-1, -1), (0, 1), (0, 0), (0, -1), (1, 1), (1, 0), (1, -1)}
 PHYSICS_TILES = {"grass"}
 
+# chunks are CHUNK_SIZE x CHUNK_SIZE tiles, CHUNK_SIZE has to be a power of two so tile -> chunk is a shift and a mask
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+
+EMPTY_TILE = 0
+CHUNK_COLORKEY = (255, 0, 255)
+
+class Tile_Chunk:
+    __slots__ = ("types", "variants", "tile_count")
+
+    def __init__(self, types: array | None = None, variants: array | None = None) -> None:
+        # type id 0 means there is no tile in that cell, index is (local_y << CHUNK_SHIFT) | local_x
+        self.types = types if types is not None else array("H", [EMPTY_TILE]) * CHUNK_AREA
+        self.variants = variants if variants is not None else array("H", [0]) * CHUNK_AREA
+        self.tile_count = CHUNK_AREA - self.types.count(EMPTY_TILE) if types is not None else 0
+
+class Tile:
+    # what the tile queries return. nothing is kept per tile in the tilemap, a Tile is only made for a tile a query hands out,
+    # and tile["type"], tile["variant"] and tile["position"] keep working like they did when tiles were stored as dicts
+    __slots__ = ("type", "variant", "position")
+
+    def __init__(self, tile_type: str, variant: int, position: tuple) -> None:
+        self.type = tile_type
+        self.variant = variant
+        self.position = position
+
+    def __getitem__(self, key: str) -> any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: any = None) -> any:
+        return getattr(self, key) if key in Tile.__slots__ else default
+
+    def __eq__(self, other: any) -> bool:
+        if not isinstance(other, Tile): return NotImplemented
+        return self.type == other.type and self.variant == other.variant and self.position == other.position
+
+    def __hash__(self) -> int:
+        return hash((self.type, self.variant, self.position))
+
+    def __repr__(self) -> str:
+        return f"Tile({self.type!r}, {self.variant}, {self.position})"
+
+class Chunk_Render_Cache:
+    def __init__(self, tilemap: "Tilemap", max_bytes: int) -> None:
+        self.tilemap = tilemap
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()
+        self.size_bytes = 0
+        # display pixels per world pixel. below 1 the render queue keeps a scaled copy of every chunk surface it draws for as long
+        # as the surface is cached, so the copies count towards max_bytes too
+        self.scale = 1.0
+
+    def get_size_bytes(self, surface: pygame.Surface) -> int:
+        width, height = surface.get_size()
+        pixels = width * height
+        if self.scale != 1:
+            pixels += int(width * self.scale) * int(height * self.scale)
+        return pixels * surface.get_bytesize()
+
+    def set_scale(self, scale: float) -> None:
+        self.scale = scale
+        self.size_bytes = sum(self.get_size_bytes(surface) for surface in self.surfaces.values())
+        self.evict()
+
+    def evict(self) -> None:
+        # least recently drawn first, the newest surface is never evicted, even if it alone is over the limit
+        while self.size_bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted_surface = self.surfaces.popitem(last=False)
+            self.size_bytes -= self.get_size_bytes(evicted_surface)
+
+    def invalidate(self, chunk_position: tuple) -> None:
+        surface = self.surfaces.pop(chunk_position, None)
+        if surface is not None:
+            self.size_bytes -= self.get_size_bytes(surface)
+
+    def clear(self) -> None:
+        self.surfaces.clear()
+        self.size_bytes = 0
+
+    def bake(self, chunk_position: tuple, chunk: Tile_Chunk) -> pygame.Surface:
+        tile_size = self.tilemap.tile_size
+        assets = self.tilemap.game.assets
+        tile_types = self.tilemap.tile_types
+
+        # colorkeyed RLE surfaces blit a lot faster than per pixel alpha ones, empty cells are filled with the colorkey
+        surface = pygame.Surface((CHUNK_SIZE * tile_size, CHUNK_SIZE * tile_size))
+        if pygame.display.get_init() and pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        surface.fill(CHUNK_COLORKEY)
+
+        types = chunk.types
+        variants = chunk.variants
+        for index in range(CHUNK_AREA):
+            type_id = types[index]
+            if type_id != EMPTY_TILE:
+                surface.blit(assets[tile_types[type_id]][variants[index]], ((index & CHUNK_MASK) * tile_size, (index >> CHUNK_SHIFT) * tile_size))
+
+        surface.set_colorkey(CHUNK_COLORKEY, pygame.RLEACCEL)
+        return surface
+
+    def get(self, chunk_position: tuple, chunk: Tile_Chunk) -> pygame.Surface:
+        surface = self.surfaces.get(chunk_position)
+        if surface is not None:
+            self.surfaces.move_to_end(chunk_position)
+            return surface
+
+        surface = self.bake(chunk_position, chunk)
+        self.surfaces[chunk_position] = surface
+        self.size_bytes += self.get_size_bytes(surface)
+        self.evict()
+        return surface
+
 class Tilemap:
-    def __init__(self, game: any, tile_size: int) -> None:
+    def __init__(self, game: any, tile_size: int, render_cache_bytes: int = 32 * 1024 * 1024) -> None:
         self.game = game
         self.tile_size = tile_size
-        self.tile_map = {}
+        self.chunks = {}
         self.offgrid_tiles = []
+        self.render_cache = Chunk_Render_Cache(self, render_cache_bytes)
+        self.static_geometry = Static_Geometry(self, CHUNK_SHIFT)
+        self.collision_world = Collision_World(self)
+        self.ray_queries = Ray_Query_Engine(self, CHUNK_SHIFT)
+
+        # bumped by every change to the tiles, so a renderer can tell when what it drew last frame is out of date
+        self.revision = 0
+
+        self.tile_types = [None]
+        self.tile_type_ids = {}
+        self.physics_type_ids = [False]
+
+        self.load_test_level()
+        self.compile()
 
+    def load_test_level(self) -> None:
         for i in range(100):
-            self.tile_map[f"{i};{5}"] = {"type": "grass", "variant": 0, "position": (i, 5)}
-            self.tile_map[f"{i};{-5}"] = {"type": "grass", "variant": 0, "position": (i, -5)}
-            self.tile_map[f"{0};{i}"] = {"type": "grass", "variant": 0, "position": (0, i)}
-            self.tile_map[f"{20};{i}"] = {"type": "grass", "variant": 0, "position": (20, i)}
-        
-            self.tile_map[f"{2};{2}"] = {"type": "grass", "variant": 0, "position": (2, 2)}
-    
-    def get_tile_in_direction(self, position: tuple | list, direction: tuple | list, max_tile_range: int = 20) -> dict | None:
-        tile_position = [int(position[0] // self.tile_size), int(position[1] // self.tile_size)]
-        for _ in range(max_tile_range):
-            tile_position[0] += direction[0]
-            tile_position[1] += direction[1]
-            tile_key = f"{tile_position[0]};{tile_position[1]}"
-            if tile_key in self.tile_map:
-                return self.tile_map[tile_key]
-
-    def get_tiles_around(self, position: tuple | list) -> List[dict]:
-        tile_position = (int(position[0] // self.tile_size), int(position[1] // self.tile_size))
+            self.set_tile((i, 5), "grass")
+            self.set_tile((i, -5), "grass")
+            self.set_tile((0, i), "grass")
+            self.set_tile((20, i), "grass")
+
+        self.set_tile((2, 2), "grass")
+
+    def compile(self) -> None:
+        # builds the derived query structures up front, otherwise they are built lazily by the first query that needs them
+        self.static_geometry.compile()
+        self.ray_queries.build_index()
+
+    def clear(self) -> None:
+        self.revision += 1
+        self.chunks.clear()
+        self.offgrid_tiles.clear()
+        self.render_cache.clear()
+        self.static_geometry.clear()
+        self.ray_queries.clear()
+
+    def set_render_scale(self, scale: float) -> None:
+        # the scale the chunk surfaces are drawn at, so the render cache can budget for the scaled copies
+        self.render_cache.set_scale(scale)
+
+    def get_type_id(self, tile_type: str) -> int:
+        type_id = self.tile_type_ids.get(tile_type)
+        if type_id is None:
+            type_id = len(self.tile_types)
+            self.tile_types.append(tile_type)
+            self.tile_type_ids[tile_type] = type_id
+            self.physics_type_ids.append(tile_type in PHYSICS_TILES)
+        return type_id
+
+    def set_tile(self, tile_position: tuple | list, tile_type: str, variant: int = 0) -> None:
+        x, y = int(tile_position[0]), int(tile_position[1])
+        chunk_position = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(chunk_position)
+        if chunk is None:
+            chunk = self.chunks[chunk_position] = Tile_Chunk()
+
+        index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        if chunk.types[index] == EMPTY_TILE:
+            chunk.tile_count += 1
+            self.ray_queries.add_tile(x, y)
+        chunk.types[index] = self.get_type_id(tile_type)
+        chunk.variants[index] = variant
+        self.revision += 1
+        self.render_cache.invalidate(chunk_position)
+        self.static_geometry.invalidate(chunk_position)
+
+    def remove_tile(self, tile_position: tuple | list) -> None:
+        x, y = int(tile_position[0]), int(tile_position[1])
+        chunk_position = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(chunk_position)
+        if chunk is None: return
+
+        index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        if chunk.types[index] == EMPTY_TILE: return
+
+        chunk.types[index] = EMPTY_TILE
+        chunk.variants[index] = 0
+        self.revision += 1
+        self.ray_queries.remove_tile(x, y)
+        chunk.tile_count -= 1
+        if not chunk.tile_count:
+            del self.chunks[chunk_position]
+        self.render_cache.invalidate(chunk_position)
+        self.static_geometry.invalidate(chunk_position)
+
+    def load_chunk(self, chunk_position: tuple, types: array, variants: array) -> None:
+        # replaces a whole chunk at once, used by the level streamer. the arrays are taken over, not copied
+        self.unload_chunk(chunk_position)
+        chunk = Tile_Chunk(types, variants)
+        if not chunk.tile_count: return
+
+        self.chunks[chunk_position] = chunk
+        self.revision += 1
+        self.ray_queries.add_chunk(chunk_position, chunk)
+        self.render_cache.invalidate(chunk_position)
+        self.static_geometry.invalidate(chunk_position)
+
+    def unload_chunk(self, chunk_position: tuple) -> None:
+        chunk = self.chunks.pop(chunk_position, None)
+        if chunk is None: return
+        self.revision += 1
+
+        self.ray_queries.remove_chunk(chunk_position, chunk)
+        self.render_cache.invalidate(chunk_position)
+        self.static_geometry.invalidate(chunk_position)
+
+    def get_type_id_at(self, x: int, y: int) -> int:
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None:
+            return EMPTY_TILE
+        return chunk.types[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+
+    def get_tile(self, tile_position: tuple | list) -> Tile | None:
+        x, y = int(tile_position[0]), int(tile_position[1])
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None: return None
+
+        index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        type_id = chunk.types[index]
+        if type_id == EMPTY_TILE: return None
+
+        return Tile(self.tile_types[type_id], chunk.variants[index], (x, y))
+
+    def iter_tiles(self) -> Iterator[Tile]:
+        for (chunk_x, chunk_y), chunk in self.chunks.items():
+            types = chunk.types
+            for index in range(CHUNK_AREA):
+                if types[index] != EMPTY_TILE:
+                    position = ((chunk_x << CHUNK_SHIFT) | (index & CHUNK_MASK), (chunk_y << CHUNK_SHIFT) | (index >> CHUNK_SHIFT))
+                    yield Tile(self.tile_types[types[index]], chunk.variants[index], position)
+
+    @property
+    def tile_count(self) -> int:
+        return sum(chunk.tile_count for chunk in self.chunks.values())
+
+    def get_tile_in_direction(self, position: tuple | list, direction: tuple | list, max_tile_range: int | None = 20) -> Tile | None:
+        # max_tile_range None searches without a limit. the tile next to the start is looked at here first, standing on the ground it
+        # is nearly always the one found and the ray query index is only needed across a gap
+        tile_x, tile_y = int(position[0] // self.tile_size), int(position[1] // self.tile_size)
+        if (direction[0] or direction[1]) and (max_tile_range is None or max_tile_range >= 1):
+            x, y = tile_x + direction[0], tile_y + direction[1]
+            chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+            if chunk is not None:
+                index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+                type_id = chunk.types[index]
+                if type_id != EMPTY_TILE:
+                    return Tile(self.tile_types[type_id], chunk.variants[index], (x, y))
+        tile_position = self.ray_queries.get_tile_position_in_direction((tile_x, tile_y), direction, max_tile_range)
+        if tile_position is None: return None
+        return self.get_tile(tile_position)
+
+    def raycast(self, origin: tuple | list, direction: tuple | list, max_distance: float | None = None) -> tuple | None:
+        # (tile, distance) for the first tile hit by a ray in any direction, origin and max_distance are in pixels
+        result = self.ray_queries.raycast(origin, direction, max_distance)
+        if result is None: return None
+        return self.get_tile(result[0]), result[1]
+
+    def get_tiles_around(self, position: tuple | list) -> List[Tile]:
+        tile_x, tile_y = int(position[0] // self.tile_size), int(position[1] // self.tile_size)
+        chunks = self.chunks
         tiles = []
-        for neighbour_tile_position in NEIGHBOURING_TILES:
-            tile_key = f"{tile_position[0] + neighbour_tile_position[0]};{tile_position[1] + neighbour_tile_position[1]}"
-            if tile_key in self.tile_map:
-                tiles.append(self.tile_map[tile_key])
+        for neighbour_x, neighbour_y in NEIGHBOURING_TILES:
+            x = tile_x + neighbour_x
+            y = tile_y + neighbour_y
+            chunk = chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+            if chunk is None: continue
+
+            index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+            type_id = chunk.types[index]
+            if type_id != EMPTY_TILE:
+                tiles.append(Tile(self.tile_types[type_id], chunk.variants[index], (x, y)))
         return tiles
-    
-    def get_physics_rects_around(self, position: tuple | list) -> List[dict]:
-        rects = []
-        for tile in self.get_tiles_around(position):
-            if tile["type"] in PHYSICS_TILES:
-                rects.append(pygame.Rect(tile["position"][0] * self.tile_size, tile["position"][1] * self.tile_size, self.tile_size, self.tile_size))
-        return rects
-    
-    def render(self, render_surface: pygame.Surface, offset = (0, 0)) -> None:
-        for tile in self.offgrid_tiles:
-            render_surface.blit(self.game.assets[tile["type"]][tile["variant"]], (tile["position"][0] - offset[0], tile["position"][1] - offset[1]))
-        
-        for x in range(offset[0] // self.tile_size, (offset[0] + render_surface.get_width()) // self.tile_size + 1):
-            for y in range(offset[1] // self.tile_size, (offset[1] + render_surface.get_height()) // self.tile_size + 1):
-                tile_key = f"{x};{y}"
-                if tile_key in self.tile_map:
-                    tile = self.tile_map[tile_key]
-                    render_surface.blit(self.game.assets[tile["type"]][tile["variant"]], (tile["position"][0] * self.tile_size - offset[0], tile["position"][1] * self.tile_size - offset[1]))
 
+    def get_physics_rects_around(self, position: tuple | list, rects: list | None = None) -> List[pygame.Rect]:
+        # merged static geometry overlapping the 3x3 tiles around position. the rects are shared between callers and must not be
+        # modified, pass a list to have it cleared and reused
+        if rects is None:
+            rects = []
+        else:
+            rects.clear()
+        return self.static_geometry.query_around(position, rects)
+
+    def get_blits(self, camera_rect: tuple | list) -> list:
+        # (surface, world position) of the off grid tiles and of every chunk that overlaps camera_rect (x, y, width, height)
+        assets = self.game.assets
+        blits = [(assets[tile["type"]][tile["variant"]], tile["position"]) for tile in self.offgrid_tiles]
+
+        chunk_pixel_size = CHUNK_SIZE * self.tile_size
+        start_x = camera_rect[0] // chunk_pixel_size
+        end_x = (camera_rect[0] + camera_rect[2] - 1) // chunk_pixel_size
+        start_y = camera_rect[1] // chunk_pixel_size
+        end_y = (camera_rect[1] + camera_rect[3] - 1) // chunk_pixel_size
+
+        for chunk_x in range(start_x, end_x + 1):
+            for chunk_y in range(start_y, end_y + 1):
+                chunk_position = (chunk_x, chunk_y)
+                chunk = self.chunks.get(chunk_position)
+                if chunk is None: continue
+
+                blits.append((self.render_cache.get(chunk_position, chunk), (chunk_x * chunk_pixel_size, chunk_y * chunk_pixel_size)))
+        return blits
+
+    def queue_render(self, render_queue: Render_Queue, camera_rect: tuple | list) -> None:
+        for surface, position in self.get_blits(camera_rect):
+            render_queue.add(surface, position, LAYER_TILES)
+
+    def render(self, render_surface: pygame.Surface, offset = (0, 0)) -> None:
+        blits = self.get_blits((offset[0], offset[1], render_surface.get_width(), render_surface.get_height()))
+        render_surface.blits([(surface, (position[0] - offset[0], position[1] - offset[1])) for surface, position in blits], doreturn=False)
@@ -0,0 +1,267 @@
+import os
+import math
+import pygame
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+from settings import Settings
+from game import Game, get_atlases
+from utils import load_atlases
+from tilemap import CHUNK_SHIFT, CHUNK_SIZE
+
+# asset paths in Settings are relative to the scripts folder
+SCRIPTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# action = movement * 2 + switch, movement 0 stands still, 1 goes left and 2 goes right
+ACTION_MOVEMENTS = ((False, False), (True, False), (False, True))
+NUMBER_OF_ACTIONS = len(ACTION_MOVEMENTS) * 2
+
+# worker commands, single bytes so nothing is pickled per step
+COMMAND_STEP = b"s"
+COMMAND_RESET = b"r"
+COMMAND_CLOSE = b"q"
+
+def get_observation_size(view_radius: int) -> int:
+    return 6 + (view_radius * 2 + 1) ** 2
+
+class Gravity_Bender_Env:
+    def __init__(self, settings: any = None, level_path: str | None = None, view_radius: int = 4, max_steps: int = 3600, fall_margin_tiles: int = 32) -> None:
+        # a headless game with a gym style reset/step interface. the observation is the player's position, velocity, gravity and
+        # switch state followed by the solid tiles in a (view_radius * 2 + 1)^2 square around the player, row by row. the reward
+        # is the distance travelled to the right in tiles, an episode ends when the player falls fall_margin_tiles out of the level.
+        # asset paths are relative to the scripts folder, so like the game itself this has to run from there
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.init()
+        settings = settings if settings is not None else Settings()
+        if level_path:
+            settings.level_path = level_path
+        self.game = Game(settings, headless=True)
+        self.view_radius = view_radius
+        self.max_steps = max_steps
+        self.fall_margin_tiles = fall_margin_tiles
+
+        self.observation_size = get_observation_size(view_radius)
+        self.number_of_actions = NUMBER_OF_ACTIONS
+        self.steps = 0
+        self.solid_grid = None
+        self.solid_grid_revision = None
+
+    def get_observation(self, observation: np.ndarray | None = None) -> np.ndarray:
+        if observation is None:
+            observation = np.zeros(self.observation_size, dtype=np.float32)
+
+        game = self.game
+        store = game.entity_store
+        index = game.player.index
+        tilemap = game.tilemap
+        tile_size = tilemap.tile_size
+        x, y = store.position[index].tolist()
+        observation[0] = x / tile_size
+        observation[1] = y / tile_size
+        observation[2] = store.velocity[index, 1] / tile_size
+        observation[3] = math.copysign(1, store.gravity[index, 1])
+        observation[4] = store.ground_selected[index]
+        observation[5] = store.is_switching[index]
+
+        center_x, center_y = game.player.get_rect().center
+        tile_x, tile_y = int(center_x // tile_size), int(center_y // tile_size)
+        grid, grid_x, grid_y = self.get_solid_grid()
+        view_size = self.view_radius * 2 + 1
+        # the grid is padded by view_radius on every side, so the view only has to be clamped once the player is out of the level
+        local_x = min(max(tile_x - self.view_radius - grid_x, 0), grid.shape[1] - view_size)
+        local_y = min(max(tile_y - self.view_radius - grid_y, 0), grid.shape[0] - view_size)
+        observation[6:] = grid[local_y:local_y + view_size, local_x:local_x + view_size].ravel()
+        return observation
+
+    def get_solid_grid(self) -> tuple:
+        # (grid, tile x of grid[0, 0], tile y of grid[0, 0]), 1 for every physics tile in the level. rebuilt when the tiles change
+        tilemap = self.game.tilemap
+        if self.solid_grid is not None and self.solid_grid_revision == tilemap.revision:
+            return self.solid_grid
+
+        radius = self.view_radius
+        view_size = radius * 2 + 1
+        bounds = tilemap.ray_queries.get_bounds() or (0, 0, -1, -1)
+        grid_x, grid_y = bounds[0] - radius, bounds[1] - radius
+        grid = np.zeros((max(bounds[3] - bounds[1] + 1 + radius * 2, view_size), max(bounds[2] - bounds[0] + 1 + radius * 2, view_size)), dtype=np.float32)
+        physics_type_ids = np.asarray(tilemap.physics_type_ids, dtype=np.float32)
+        for (chunk_x, chunk_y), chunk in tilemap.chunks.items():
+            x = (chunk_x << CHUNK_SHIFT) - grid_x
+            y = (chunk_y << CHUNK_SHIFT) - grid_y
+            grid[y:y + CHUNK_SIZE, x:x + CHUNK_SIZE] = physics_type_ids[np.frombuffer(chunk.types, dtype=np.uint16)].reshape(CHUNK_SIZE, CHUNK_SIZE)
+
+        self.solid_grid = (grid, grid_x, grid_y)
+        self.solid_grid_revision = tilemap.revision
+        return self.solid_grid
+
+    def reset(self, seed: int | None = None, observation: np.ndarray | None = None) -> tuple:
+        # (observation, info), pass observation to have it written into an existing array
+        self.game.reset(seed)
+        self.steps = 0
+        return self.get_observation(observation), {"seed": self.game.seed}
+
+    def take_snapshot(self) -> bytes:
+        return self.game.take_snapshot()
+
+    def restore_snapshot(self, snapshot: bytes, observation: np.ndarray | None = None) -> np.ndarray:
+        # back to the state of the snapshot, from this env or another one on the same level. returns the observation there
+        self.game.restore_snapshot(snapshot)
+        self.steps = self.game.ticks
+        return self.get_observation(observation)
+
+    def step(self, action: int, observation: np.ndarray | None = None) -> tuple:
+        # (observation, reward, terminated, truncated, info)
+        game = self.game
+        movement, switch_ground = divmod(int(action), 2)
+        game.player_movement = list(ACTION_MOVEMENTS[movement])
+        game.switch_ground_requested = bool(switch_ground)
+
+        x = game.player.position[0]
+        game.step()
+        self.steps += 1
+        reward = (game.player.position[0] - x) / game.tilemap.tile_size
+
+        terminated = False
+        bounds = game.tilemap.ray_queries.get_bounds()
+        if bounds is not None:
+            margin = self.fall_margin_tiles
+            tile_y = game.player.position[1] / game.tilemap.tile_size
+            terminated = tile_y < bounds[1] - margin or tile_y > bounds[3] + margin
+        truncated = self.steps >= self.max_steps
+        return self.get_observation(observation), float(reward), terminated, truncated, {}
+
+def warm_atlas_cache(settings: any) -> None:
+    # builds every texture atlas into the cache once, so the workers all find them there instead of each building them on a cold cache
+    working_directory = os.getcwd()
+    os.chdir(SCRIPTS_DIRECTORY)
+    try:
+        load_atlases(get_atlases(settings), cache_directory=settings.asset_paths["cache"], max_workers=settings.asset_loader_threads)
+    finally:
+        os.chdir(working_directory)
+
+def run_worker(connection: any, shared_memory_name: str, number_of_envs: int, env_indices: list, env_kwargs: dict) -> None:
+    # runs the envs at env_indices, reading actions from and writing results to the shared buffers
+    os.chdir(SCRIPTS_DIRECTORY)
+    memory = shared_memory.SharedMemory(name=shared_memory_name)
+    buffers = Vector_Env.get_buffers(memory, number_of_envs, get_observation_size(env_kwargs.get("view_radius", 4)))
+    envs = [Gravity_Bender_Env(**env_kwargs) for _ in env_indices]
+
+    try:
+        while True:
+            command = connection.recv_bytes()
+            if command == COMMAND_CLOSE: break
+
+            if command == COMMAND_RESET:
+                for env, index in zip(envs, env_indices):
+                    env.reset(int(buffers["seeds"][index]), buffers["observations"][index])
+            else:
+                for env, index in zip(envs, env_indices):
+                    _, reward, terminated, truncated, _ = env.step(buffers["actions"][index], buffers["observations"][index])
+                    buffers["rewards"][index] = reward
+                    buffers["terminated"][index] = terminated
+                    buffers["truncated"][index] = truncated
+                    # finished episodes start over straight away, the observation returned is the first one of the new episode
+                    if terminated or truncated:
+                        env.reset(None, buffers["observations"][index])
+            connection.send_bytes(command)
+    finally:
+        del buffers
+        memory.close()
+
+class Vector_Env:
+    def __init__(self, number_of_envs: int, number_of_workers: int | None = None, seed: int = 0, **env_kwargs: any) -> None:
+        # number_of_envs Gravity_Bender_Envs spread over a pool of worker processes. observations, actions, rewards and flags live in
+        # one shared memory block, a step only sends a single byte to every worker and waits for one back.
+        # the workers are started with spawn, scripts using this need an if __name__ == "__main__" guard
+        self.number_of_envs = number_of_envs
+        self.observation_size = get_observation_size(env_kwargs.get("view_radius", 4))
+        self.number_of_actions = NUMBER_OF_ACTIONS
+        self.seed = seed
+
+        self.memory = shared_memory.SharedMemory(create=True, size=Vector_Env.get_buffer_size(number_of_envs, self.observation_size))
+        self.buffers = Vector_Env.get_buffers(self.memory, number_of_envs, self.observation_size)
+
+        settings = env_kwargs.get("settings")
+        warm_atlas_cache(settings if settings is not None else Settings())
+
+        number_of_workers = min(number_of_workers or os.cpu_count() or 1, number_of_envs)
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        self.workers = []
+        for worker_index in range(number_of_workers):
+            parent_connection, child_connection = context.Pipe()
+            env_indices = list(range(worker_index, number_of_envs, number_of_workers))
+            worker = context.Process(target=run_worker, args=(child_connection, self.memory.name, number_of_envs, env_indices, env_kwargs), daemon=True)
+            worker.start()
+            child_connection.close()
+            self.connections.append(parent_connection)
+            self.workers.append(worker)
+        self.closed = False
+
+    @staticmethod
+    def get_buffer_layout(number_of_envs: int, observation_size: int) -> list:
+        # (name, dtype, shape) of every buffer, in the order they are laid out in the shared memory block
+        return [("observations", np.float32, (number_of_envs, observation_size)), ("rewards", np.float32, (number_of_envs,)),
+                ("actions", np.int32, (number_of_envs,)), ("seeds", np.int64, (number_of_envs,)),
+                ("terminated", np.bool_, (number_of_envs,)), ("truncated", np.bool_, (number_of_envs,))]
+
+    @staticmethod
+    def get_buffer_size(number_of_envs: int, observation_size: int) -> int:
+        return sum(np.dtype(dtype).itemsize * math.prod(shape) for _, dtype, shape in Vector_Env.get_buffer_layout(number_of_envs, observation_size))
+
+    @staticmethod
+    def get_buffers(memory: shared_memory.SharedMemory, number_of_envs: int, observation_size: int) -> dict:
+        buffers = {}
+        offset = 0
+        for name, dtype, shape in Vector_Env.get_buffer_layout(number_of_envs, observation_size):
+            buffers[name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+            offset += np.dtype(dtype).itemsize * math.prod(shape)
+        return buffers
+
+    def send(self, command: bytes) -> None:
+        for connection in self.connections:
+            connection.send_bytes(command)
+        for connection in self.connections:
+            connection.recv_bytes()
+
+    def reset(self, seed: int | None = None) -> tuple:
+        # env i is seeded with seed + i
+        if seed is not None:
+            self.seed = seed
+        self.buffers["seeds"][:] = np.arange(self.seed, self.seed + self.number_of_envs)
+        self.send(COMMAND_RESET)
+        return self.buffers["observations"].copy(), {}
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self.buffers["actions"][:] = actions
+        for connection in self.connections:
+            connection.send_bytes(COMMAND_STEP)
+
+    def step_wait(self) -> tuple:
+        # the arrays are copies, the shared buffers are overwritten by the next step
+        for connection in self.connections:
+            connection.recv_bytes()
+        buffers = self.buffers
+        return buffers["observations"].copy(), buffers["rewards"].copy(), buffers["terminated"].copy(), buffers["truncated"].copy(), {}
+
+    def step(self, actions: np.ndarray) -> tuple:
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self) -> None:
+        if self.closed: return
+        self.closed = True
+        for connection in self.connections:
+            connection.send_bytes(COMMAND_CLOSE)
+        for worker in self.workers:
+            worker.join()
+        del self.buffers
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self) -> "Vector_Env":
+        return self
+
+    def __exit__(self, *exception: any) -> None:
+        self.close()
@@ -1,7 +1,13 @@
 import pygame
 import os
-import time
-from typing import List, Tuple
+import json
+import hashlib
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict
+
+# bump this when the atlas layout or the way frames are processed changes, it invalidates every cached atlas
+ATLAS_CACHE_VERSION = 1
 
 def load_image(path: str, scaling_factor: float = 1.0, size: Tuple[int, int] | None = None,  colorkey: pygame.Color | None = None) -> pygame.Surface:
     image = pygame.image.load(path).convert_alpha()
@@ -16,47 +22,155 @@ def load_image(path: str, scaling_factor: float = 1.0, size: Tuple[int, int] | N
 
     return image
 
+def get_image_names(path: str) -> List[str]:
+    return sorted(os.listdir(path), key=lambda x: int(x.split(".")[0]))
+
 def load_images(path: str, scaling_factor: float = 1.0, size: Tuple[int, int] | None = None, colorkey: pygame.Color | None = None) -> List[pygame.Surface]:
     images = []
-    for image_name in sorted(os.listdir(path), key=lambda x: int(x.split(".")[0])):
+    for image_name in get_image_names(path):
         images.append(load_image(path + "/" + image_name, scaling_factor=scaling_factor, size=size, colorkey=colorkey))
 
     return images
 
-class Timer:
-    def __init__(self, duration: float | int) -> None:
-        self.duration = duration
-        self.is_active = False
-
-        self.start_time = 0
-        self.current_time = 0
-
-        self.finished = False
-    
-    def __bool__(self) -> bool:
-        return self.is_active
-    
-    def __eq__(self, other: bool) -> bool:
-        if isinstance(other, bool):
-            return self.__bool__() == other
-        return NotImplemented
-    
-    def get_time_since_start(self) -> float:
-        return self.current_time - self.start_time
-    
-    def start(self) -> None:
-        self.start_time = int(time.time() * 1000)
-        self.is_active = True
-    
-    def end(self) -> None:
-        self.is_active = False
-    
-    def update(self) -> None:
-        self.current_time = int(time.time() * 1000)
-        self.finished = False
-
-        if self.current_time - self.start_time >= self.duration and self.is_active:
-            self.is_active = False
-            self.finished = True
-        
-        return self.finished
\ No newline at end of file
+def get_atlas_cache_path(path: str, scaling_factor: float, size: Tuple[int, int] | None, cache_directory: str) -> str:
+    key = hashlib.sha1()
+    key.update(repr((ATLAS_CACHE_VERSION, os.path.abspath(path), scaling_factor, tuple(size) if size else None)).encode())
+    for image_name in get_image_names(path):
+        image_stat = os.stat(path + "/" + image_name)
+        key.update(repr((image_name, image_stat.st_mtime_ns, image_stat.st_size)).encode())
+
+    name = os.path.normpath(path).replace("\\", "/").strip("./").replace("/", "_")
+    return os.path.join(cache_directory, f"{name}-{key.hexdigest()[:16]}")
+
+def build_atlas(path: str, scaling_factor: float = 1.0, size: Tuple[int, int] | None = None, cache_directory: str | None = None) -> Tuple[pygame.Surface, List[Tuple[int, int, int, int]]]:
+    # safe to call from worker threads, it does not touch the display so the result still has to be converted on the main thread
+    if cache_directory:
+        cache_path = get_atlas_cache_path(path, scaling_factor, size, cache_directory)
+        # another process can replace or clean up the files between any two calls here, anything missing is a cache miss
+        try:
+            with open(cache_path + ".json") as file:
+                frame_rects = [tuple(rect) for rect in json.load(file)["frames"]]
+            return pygame.image.load(cache_path + ".png"), frame_rects
+        except (FileNotFoundError, ValueError, pygame.error):
+            pass
+
+    images = []
+    for image_name in get_image_names(path):
+        image = pygame.image.load(path + "/" + image_name)
+        if size:
+            image = pygame.transform.scale(image, size)
+        else:
+            image = pygame.transform.scale_by(image, scaling_factor)
+        images.append(image)
+
+    # frames are packed left to right in a single strip
+    atlas = pygame.Surface((sum(image.get_width() for image in images), max(image.get_height() for image in images)), pygame.SRCALPHA, 32)
+    frame_rects = []
+    x = 0
+    for image in images:
+        atlas.blit(image, (x, 0))
+        frame_rects.append((x, 0, image.get_width(), image.get_height()))
+        x += image.get_width()
+
+    if cache_directory:
+        os.makedirs(cache_directory, exist_ok=True)
+        # write to temporary files first so a crash never leaves a half written atlas behind. they are named per build, so
+        # processes building the same atlas at the same time never write to or replace each other's temporary files
+        temporary_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+        pygame.image.save(atlas, temporary_path + ".png")
+        with open(temporary_path + ".json", "w") as file:
+            json.dump({"version": ATLAS_CACHE_VERSION, "source": path, "frames": frame_rects}, file)
+        os.replace(temporary_path + ".png", cache_path + ".png")
+        os.replace(temporary_path + ".json", cache_path + ".json")
+
+        # drop the atlases of older versions of these frames, but never the current one or a build still in progress
+        prefix = os.path.basename(cache_path).rsplit("-", 1)[0] + "-"
+        current_name = os.path.basename(cache_path)
+        for file_name in os.listdir(cache_directory):
+            if not file_name.startswith(prefix) or file_name.startswith(current_name) or ".tmp." in file_name: continue
+            try:
+                os.remove(os.path.join(cache_directory, file_name))
+            except FileNotFoundError:
+                pass
+
+    return atlas, frame_rects
+
+def split_atlas(atlas: pygame.Surface, frame_rects: List[Tuple[int, int, int, int]], colorkey: pygame.Color | None = None) -> List[pygame.Surface]:
+    if pygame.display.get_surface() is not None:
+        atlas = atlas.convert_alpha()
+
+    images = []
+    for frame_rect in frame_rects:
+        image = atlas.subsurface(frame_rect)
+        if colorkey:
+            image.set_colorkey(colorkey)
+        images.append(image)
+
+    return images
+
+def load_atlas(path: str, scaling_factor: float = 1.0, size: Tuple[int, int] | None = None, colorkey: pygame.Color | None = None, cache_directory: str | None = None) -> List[pygame.Surface]:
+    atlas, frame_rects = build_atlas(path, scaling_factor=scaling_factor, size=size, cache_directory=cache_directory)
+    return split_atlas(atlas, frame_rects, colorkey=colorkey)
+
+def load_atlases(atlases: Dict[str, dict], cache_directory: str | None = None, max_workers: int | None = None) -> Dict[str, List[pygame.Surface]]:
+    # atlases maps a name to the keyword arguments of load_atlas, the atlases are built or read from the cache in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for name, arguments in atlases.items():
+            build_arguments = {key: value for key, value in arguments.items() if key != "colorkey"}
+            futures[name] = executor.submit(build_atlas, cache_directory=cache_directory, **build_arguments)
+
+        return {name: split_atlas(*future.result(), colorkey=atlases[name].get("colorkey")) for name, future in futures.items()}
+
+class Game_Clock:
+    def __init__(self) -> None:
+        # game time only moves when tick is called, once per frame, so everything that reads it in a frame sees the same "now"
+        self.time_ms = 0.0
+        self.dt = 0.0
+        self.time_scale = 1.0
+        self.paused = False
+
+        self.manual_step = False
+        self.pending_step_s = 0.0
+
+    def reset(self) -> None:
+        self.time_ms = 0.0
+        self.dt = 0.0
+        self.paused = False
+        self.pending_step_s = 0.0
+
+    def get_step_time(self, real_dt: float) -> float:
+        # how much game time a frame that took real_dt seconds is worth
+        if self.manual_step:
+            dt = self.pending_step_s
+            self.pending_step_s = 0.0
+            return dt
+        if self.paused:
+            return 0.0
+        return real_dt * self.time_scale
+
+    def advance(self, dt: float) -> None:
+        self.dt = dt
+        self.time_ms += dt * 1000
+
+    def tick(self, real_dt: float) -> float:
+        dt = self.get_step_time(real_dt)
+        self.advance(dt)
+        return dt
+
+    def step(self, dt: float) -> None:
+        # in manual step mode the next tick advances by exactly the queued amount, whatever real time has passed
+        self.pending_step_s += dt
+
+    def set_manual_step(self, manual_step: bool) -> None:
+        self.manual_step = manual_step
+        self.pending_step_s = 0.0
+
+    def pause(self) -> None:
+        self.paused = True
+
+    def resume(self) -> None:
+        self.paused = False
+
+    def toggle_pause(self) -> None:
+        self.paused = not self.paused
\ No newline at end of file